@@ -0,0 +1,103 @@
+import json
+import zlib
+from typing import Iterable, List, Optional, Sequence
+
+import aiosqlite
+
+from database import Database
+
+# Первый байт записи — формат: сжатый zlib JSON или JSON как есть,
+# если сжатие не выигрывает (короткие обращения)
+FORMAT_ZLIB = b"z"
+FORMAT_RAW = b"j"
+COMPRESS_LEVEL = 9
+
+# Поля reports, которые уходят в сжатый блоб; id, user_id и даты
+# остаются обычными колонками для выборок и сортировки
+PACKED_FIELDS = ("username", "first_name", "message", "reply", "replied_by")
+
+
+def pack(values: Sequence) -> bytes:
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":")).encode()
+    compressed = zlib.compress(raw, COMPRESS_LEVEL)
+    if len(compressed) < len(raw):
+        return FORMAT_ZLIB + compressed
+    return FORMAT_RAW + raw
+
+
+def unpack(data: bytes) -> list:
+    kind, body = data[:1], data[1:]
+    if kind == FORMAT_ZLIB:
+        body = zlib.decompress(body)
+    elif kind != FORMAT_RAW:
+        raise ValueError(f"Unknown archive record format: {kind!r}")
+    return json.loads(body)
+
+
+class ReportArchive:
+    """Архив отвеченных обращений вне горячей таблицы reports.
+
+    Очистка переносит старые отвеченные обращения сюда вместо удаления:
+    reports остаётся маленькой, а история доступна по id и user_id.
+    Текстовые поля хранятся одним сжатым блобом на запись, для поиска
+    по ним ведётся отдельный FTS5-индекс без копии текста.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    @staticmethod
+    async def move(conn: aiosqlite.Connection, ids: Iterable[int]) -> int:
+        """Переносит обращения ids в архив в уже открытой транзакции.
+
+        Сами строки из reports не удаляет: это делает вызывающий код
+        вместе с остальной уборкой по этим id.
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        async with conn.execute(
+            "SELECT id, user_id, created_at, replied_at, "
+            f"{', '.join(PACKED_FIELDS)} FROM reports WHERE id IN ({placeholders})",
+            ids
+        ) as cursor:
+            rows = await cursor.fetchall()
+        # id из reports (AUTOINCREMENT) не переиспользуются, конфликтов быть не может
+        await conn.executemany(
+            "INSERT INTO reports_archive (id, user_id, created_at, replied_at, data) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(*row[:4], pack(row[4:])) for row in rows]
+        )
+        await conn.executemany(
+            "INSERT INTO reports_archive_fts (rowid, message, reply) VALUES (?, ?, ?)",
+            [(row[0], row[6], row[7]) for row in rows]
+        )
+        return len(rows)
+
+    async def get(self, report_id: int) -> Optional[tuple]:
+        """Обращение в том же виде, что SELECT для карточки, со статусом 'archived'"""
+        row = await self.db.fetchone(
+            "SELECT id, user_id, created_at, replied_at, data FROM reports_archive WHERE id = ?",
+            (report_id,)
+        )
+        if row is None:
+            return None
+        rid, user_id, created_at, replied_at, data = row
+        username, first_name, message, reply, replied_by = unpack(data)
+        return (
+            rid, user_id, username, first_name, message, "archived",
+            reply, replied_by, created_at, replied_at,
+        )
+
+    async def by_user(self, user_id: int, limit: int = 10) -> List[tuple]:
+        """(id, message, status, reply) последних архивных обращений пользователя"""
+        rows = await self.db.fetchall(
+            "SELECT id, data FROM reports_archive WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit)
+        )
+        result = []
+        for rid, data in rows:
+            _, _, message, reply, _ = unpack(data)
+            result.append((rid, message, "archived", reply))
+        return result
@@ -0,0 +1,80 @@
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Сотрудник считается на месте, если что-то делал в боте за это время
+ACTIVE_WINDOW = 30 * 60
+# Через столько назначенное и не отвеченное обращение уходит всем
+ASSIGNMENT_TIMEOUT = 15 * 60
+
+
+class LoadBalancer:
+    """Выбор сотрудника для нового обращения по открытой нагрузке.
+
+    Держит в памяти число открытых назначенных обращений на каждого и
+    время последней активности. Новое обращение получает активный сотрудник
+    с наименьшей нагрузкой (при равенстве — тот, кому назначали давнее).
+    Если активных нет, pick() возвращает None и обращение рассылается всем.
+    Нагрузка восстанавливается из reports при старте; активность — нет,
+    поэтому до первых действий персонала после перезапуска идёт рассылка.
+    """
+
+    def __init__(self, active_window: float = ACTIVE_WINDOW):
+        self.active_window = active_window
+        self._load: Dict[str, int] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._last_assigned: Dict[str, float] = {}
+        self.assigned = 0
+        self.broadcasts = 0
+
+    async def load(self, db: Database):
+        rows = await db.fetchall(
+            "SELECT assigned_to, COUNT(*) FROM reports "
+            "WHERE status = 'open' AND assigned_to IS NOT NULL GROUP BY assigned_to"
+        )
+        self._load = dict(rows)
+        logger.info(f"Assignment load restored: {self._load}")
+
+    def touch(self, username: str):
+        self._last_seen[username.lower()] = time.monotonic()
+
+    def is_active(self, username: str) -> bool:
+        seen = self._last_seen.get(username)
+        return seen is not None and time.monotonic() - seen <= self.active_window
+
+    def pick(self, candidates: Iterable[str]) -> Optional[str]:
+        active = [uname for uname in candidates if self.is_active(uname)]
+        if not active:
+            self.broadcasts += 1
+            return None
+        return min(active, key=lambda u: (self._load.get(u, 0), self._last_assigned.get(u, 0.0)))
+
+    def assign(self, username: str):
+        self._load[username] = self._load.get(username, 0) + 1
+        self._last_assigned[username] = time.monotonic()
+        self.assigned += 1
+
+    def release(self, username: str):
+        count = self._load.get(username, 0) - 1
+        if count > 0:
+            self._load[username] = count
+        else:
+            self._load.pop(username, None)
+
+    def forget(self, username: str):
+        """Сотрудник удалён: больше не получает назначений"""
+        self._load.pop(username, None)
+        self._last_seen.pop(username, None)
+        self._last_assigned.pop(username, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "assigned": self.assigned,
+            "broadcasts": self.broadcasts,
+            "open_assigned": sum(self._load.values()),
+            "active_staff": sum(1 for uname in self._last_seen if self.is_active(uname)),
+        }
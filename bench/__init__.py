@@ -0,0 +1,4 @@
+"""Офлайн-бенчмарки бота: фейковый Bot API и генератор нагрузки.
+
+Запуск из корня репозитория: python -m bench.loadgen --help
+"""
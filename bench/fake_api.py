@@ -0,0 +1,103 @@
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from aiohttp import web
+
+
+class ApiCall(NamedTuple):
+    at: float
+    method: str
+    params: Dict[str, Any]
+
+
+class FakeBotApi:
+    """Локальная замена Bot API для бенчмарков.
+
+    Принимает любые методы по пути /bot<token>/<method>, записывает вызовы
+    с моментом получения и отвечает правдоподобным результатом. Умеет
+    добавлять задержку ответа и отвечать 429 с заданной вероятностью.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls: List[ApiCall] = []
+        self.throttled = 0
+        self._message_id = 1000
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def calls_of(self, method: str) -> List[ApiCall]:
+        method = method.lower()
+        return [call for call in self.calls if call.method == method]
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = {
+            # Загруженные файлы (sendDocument) — как (имя, содержимое)
+            key: (value.filename, value.file.read()) if isinstance(value, web.FileField) else value
+            for key, value in (await request.post()).items()
+        }
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+        if self.rate_429 and method != "getme" and self._random.random() < self.rate_429:
+            self.throttled += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        self.calls.append(ApiCall(time.monotonic(), method, params))
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getme":
+            return {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method in ("sendmessage", "editmessagetext", "senddocument"):
+            if method != "editmessagetext":
+                self._message_id += 1
+                message_id = self._message_id
+            else:
+                message_id = int(params.get("message_id", 0))
+            message = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }
+            if "reply_markup" in params:
+                message["reply_markup"] = json.loads(params["reply_markup"])
+            return message
+        return True
@@ -0,0 +1,349 @@
+"""Генератор нагрузки: N пользователей создают обращения, M сотрудников отвечают.
+
+Бот работает целиком (dp, пул апдейтов, outbox, SQLite), но Bot API
+подменяется локальным FakeBotApi. Апдейты подаются через dp.feed_raw_update,
+как их подал бы polling. В конце печатаются пропускная способность и
+p50/p95/p99 по хендлерам, доставке уведомлений персоналу и очистке.
+
+    python -m bench.loadgen --users 200 --staff 5 --latency 0.05 --rate-429 0.01 \\
+        --global-rate 1000 --chat-rate 1000 --chat-burst 1000
+    python -m bench.loadgen --budget process_report=50 --budget notify_staff=2000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bench.fake_api import FakeBotApi
+from callbacks import CreateReport, ReplyReport
+from sender import GLOBAL_RATE, PER_CHAT_BURST, PER_CHAT_RATE, Sender
+
+REPORT_CREATED_RE = re.compile(r"Обращение #(\d+) создано")
+NEW_REPORT_RE = re.compile(r"(?:Новое обращение|Вам назначено обращение) #(\d+)")
+DRAIN_TIMEOUT = 120.0
+
+USER_ID_BASE = 10_000_000
+STAFF_ID_BASE = 1_000
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Квантиль по ближайшему рангу на точных выборках"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Samples:
+    """Точные замеры по имени: в бенчмарке их немного, гистограмма не нужна."""
+
+    def __init__(self):
+        self.values: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def add(self, name: str, seconds: float, error: bool = False):
+        self.values[name].append(seconds)
+        if error:
+            self.errors[name] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "count": len(values),
+                "errors": self.errors[name],
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": max(values) * 1000,
+            }
+            for name, values in sorted(self.values.items())
+        }
+
+
+def timing_middleware(samples: Samples, resolve: Optional[Callable[[Any], Optional[str]]] = None):
+    """Inner-middleware: время самого хендлера, без очереди и throttling"""
+    async def middleware(
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = resolve(event) if resolve else None
+        if name is None:
+            name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        error = True
+        try:
+            result = await handler(event, data)
+            error = False
+            return result
+        finally:
+            samples.add(name, time.perf_counter() - started, error)
+    return middleware
+
+
+class UpdateFactory:
+    """Собирает сырые апдейты Telegram в виде dict для dp.feed_raw_update"""
+
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.fed = 0
+
+    @staticmethod
+    def _user(user_id: int, username: str) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": username, "username": username}
+
+    def message(self, user_id: int, username: str, text: str) -> Dict[str, Any]:
+        self.fed += 1
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id, username),
+                "text": text,
+            },
+        }
+
+    def callback(self, user_id: int, username: str, data: str) -> Dict[str, Any]:
+        self.fed += 1
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id, username),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 42, "is_bot": True, "first_name": "Bench"},
+                    "text": "menu",
+                },
+            },
+        }
+
+
+def staff_name(i: int) -> str:
+    return f"bench_staff_{i}"
+
+
+def user_name(i: int) -> str:
+    return f"bench_user_{i}"
+
+
+def import_bot(api: FakeBotApi, db_path: str, staff: int):
+    """Импортирует bot.py с окружением бенчмарка и направляет сессию на FakeBotApi"""
+    os.environ["BOT_TOKEN"] = "42:BENCH"
+    os.environ["ADMINS"] = ",".join(staff_name(i) for i in range(staff))
+    os.environ["DB_PATH"] = db_path
+    os.environ["METRICS_PORT"] = "0"
+
+    from aiogram.client.telegram import TelegramAPIServer
+    import bot as app
+
+    app.bot.session.api = TelegramAPIServer.from_base(api.url)
+    return app
+
+
+def apply_rate_limits(app, args):
+    """Подменяет лимиты Sender, если они заданы не по умолчанию"""
+    limits = (args.global_rate, args.chat_rate, args.chat_burst)
+    if limits == (GLOBAL_RATE, PER_CHAT_RATE, PER_CHAT_BURST):
+        return
+    app.sender = app.outbox.sender = Sender(
+        app.bot, global_rate=args.global_rate,
+        per_chat_rate=args.chat_rate, per_chat_burst=args.chat_burst,
+    )
+
+
+async def drain(app, timeout: float = DRAIN_TIMEOUT):
+    """Ждёт, пока пул апдейтов и outbox опустеют"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not app.update_pool.depth and not await app.outbox.pending():
+            return
+        app.outbox.wake()
+        await asyncio.sleep(0.05)
+    raise RuntimeError(
+        f"Load did not drain in {timeout}s: "
+        f"{app.update_pool.depth} updates, {await app.outbox.pending()} outbox jobs pending"
+    )
+
+
+async def run(args) -> Dict[str, Any]:
+    api = FakeBotApi(
+        latency=args.latency, jitter=args.jitter, rate_429=args.rate_429, seed=args.seed
+    )
+    await api.start()
+    workdir = tempfile.mkdtemp(prefix="dmarena-bench-")
+    app = import_bot(api, os.path.join(workdir, "bench.db"), args.staff)
+    apply_rate_limits(app, args)
+
+    samples = Samples()
+    app.router.message.middleware(timing_middleware(samples))
+    app.router.callback_query.middleware(timing_middleware(samples, app.callback_router.handler_name))
+    updates = UpdateFactory()
+    feed = lambda update: app.dp.feed_raw_update(app.bot, update)
+
+    await app.on_startup()
+    try:
+        # Сотрудники открывают панель, чтобы их chat_id попал в реестр
+        for i in range(args.staff):
+            await feed(updates.message(STAFF_ID_BASE + i, staff_name(i), "/panel"))
+        await drain(app)
+
+        # Фаза 1: пользователи создают обращения
+        report_fed_at: Dict[int, float] = {}
+        started = time.monotonic()
+        for i in range(args.users):
+            user_id = USER_ID_BASE + i
+            await feed(updates.callback(user_id, user_name(i), CreateReport().pack()))
+            report_fed_at[user_id] = time.monotonic()
+            await feed(updates.message(user_id, user_name(i), f"Проблема номер {i}"))
+        await drain(app)
+        create_seconds = time.monotonic() - started
+
+        # Фан-аут: от подачи текста обращения до последнего уведомления персоналу
+        report_owner: Dict[int, int] = {}
+        for call in api.calls_of("sendMessage"):
+            match = REPORT_CREATED_RE.search(call.params.get("text", ""))
+            if match:
+                report_owner[int(match.group(1))] = int(call.params["chat_id"])
+        delivered: Dict[int, float] = {}
+        for call in api.calls_of("sendMessage"):
+            match = NEW_REPORT_RE.search(call.params.get("text", ""))
+            if match:
+                report_id = int(match.group(1))
+                delivered[report_id] = max(delivered.get(report_id, 0.0), call.at)
+        for report_id, at in delivered.items():
+            owner = report_owner.get(report_id)
+            if owner in report_fed_at:
+                samples.add("notify_staff", at - report_fed_at[owner])
+
+        # Фаза 2: сотрудники по очереди отвечают на открытые обращения
+        rows = await app.db.fetchall("SELECT id FROM reports WHERE status = 'open' ORDER BY id")
+        started = time.monotonic()
+        for n, (report_id,) in enumerate(rows):
+            i = n % args.staff
+            await feed(updates.callback(STAFF_ID_BASE + i, staff_name(i), ReplyReport(report_id=report_id).pack()))
+            await feed(updates.message(STAFF_ID_BASE + i, staff_name(i), f"Ответ на {report_id}"))
+        await drain(app)
+        reply_seconds = time.monotonic() - started
+
+        # Фаза 3: очистка состарившихся отвеченных обращений
+        await app.db.execute(
+            "UPDATE reports SET replied_at = '2000-01-01 00:00:00' WHERE status = 'answered'"
+        )
+        started = time.perf_counter()
+        cleanup = await app.cleanup_old_reports()
+        samples.add("cleanup_old_reports", time.perf_counter() - started)
+        await drain(app)
+    finally:
+        await app.on_shutdown()
+        await app.bot.session.close()
+        await api.stop()
+
+    return {
+        "config": vars(args),
+        "updates": updates.fed,
+        "reports": len(rows),
+        "create_seconds": round(create_seconds, 3),
+        "reply_seconds": round(reply_seconds, 3),
+        "create_reports_per_second": round(args.users / create_seconds, 1) if create_seconds else 0,
+        "replies_per_second": round(len(rows) / reply_seconds, 1) if reply_seconds else 0,
+        "api_calls": len(api.calls),
+        "api_throttled": api.throttled,
+        "cleanup": cleanup,
+        "latency": samples.summary(),
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    print(
+        f"updates: {result['updates']}, reports: {result['reports']}, "
+        f"api calls: {result['api_calls']} (429: {result['api_throttled']})"
+    )
+    print(
+        f"create: {result['create_seconds']}s ({result['create_reports_per_second']}/s), "
+        f"reply: {result['reply_seconds']}s ({result['replies_per_second']}/s)"
+    )
+    print(f"cleanup: {result['cleanup']}")
+    print()
+    print(f"{'name':<24}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in result["latency"].items():
+        print(
+            f"{name:<24}{row['count']:>7}{row['errors']:>5}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}"
+        )
+
+
+def check_budgets(result: Dict[str, Any], budgets: List[str]) -> List[str]:
+    """Возвращает нарушения бюджетов вида name=p95_ms"""
+    failures = []
+    for budget in budgets:
+        name, _, limit = budget.partition("=")
+        row = result["latency"].get(name)
+        if row is None:
+            failures.append(f"{name}: no samples")
+        elif row["p95_ms"] > float(limit):
+            failures.append(f"{name}: p95 {row['p95_ms']:.2f} ms > {float(limit):.2f} ms")
+    return failures
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="DMArena bot load test against a fake Bot API")
+    parser.add_argument("--users", type=int, default=20, help="пользователей, создающих обращения")
+    parser.add_argument("--staff", type=int, default=3, help="сотрудников, отвечающих на них")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа API, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--seed", type=int, default=None)
+    # Лимиты Telegram: при 1 сообщении в секунду на чат фан-аут персоналу
+    # упирается в них, и для замера самого бота их стоит поднять
+    parser.add_argument("--global-rate", type=float, default=GLOBAL_RATE, help="лимит Sender, сообщений/с")
+    parser.add_argument("--chat-rate", type=float, default=PER_CHAT_RATE, help="лимит на чат, сообщений/с")
+    parser.add_argument("--chat-burst", type=float, default=PER_CHAT_BURST, help="всплеск на чат")
+    parser.add_argument(
+        "--budget", action="append", default=[], metavar="NAME=P95_MS",
+        help="порог p95; при превышении код выхода 1 (можно несколько)",
+    )
+    parser.add_argument("--json", metavar="FILE", help="сохранить результат в JSON")
+    args = parser.parse_args(argv)
+    if args.staff < 1:
+        parser.error("--staff must be at least 1")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # До импорта bot.py: его basicConfig(INFO) тогда ничего не меняет и не шумит
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(run(args))
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    failures = check_budgets(result, args.budget)
+    for failure in failures:
+        print(f"BUDGET EXCEEDED {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,53 @@
 import os
+import re
+import time
+import signal
+import secrets
 import asyncio
 import logging
+import tempfile
 import aiosqlite
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from typing import Callable, Dict, Any, Awaitable
 
-from aiogram import Bot, Dispatcher, Router, F, BaseMiddleware
+from aiogram import Bot, Dispatcher, Router, BaseMiddleware, html
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
-    BotCommand
+    BotCommand, User, FSInputFile
 )
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from database import Database
+from staff import StaffRoster
+from chat_registry import ChatRegistry
+from sender import Sender
+from outbox import Outbox, OutboxJob
+from archive import ReportArchive, unpack as unpack_archived
+from assignment import LoadBalancer, ASSIGNMENT_TIMEOUT
+from sla import SlaStats, format_sla
+from export import export_reports, FORMATS as EXPORT_FORMATS
+from migrations import run_migrations
+from fsm_storage import SQLiteStorage
+from workers import UpdateWorkerPool
+from cache import LRUCache
+from metrics import (
+    Metrics, HandlerMetricsMiddleware, ApiMetricsMiddleware, db_observer, format_stats
+)
+from throttling import ThrottlingMiddleware
+from callbacks import (
+    CallbackRouter, BackToMenu, Connect, Support, CreateReport, MyReports,
+    StaffOpenReports, OpenPage, StaffAnsweredReports, AnsweredPage, BackToPanel,
+    ViewReport, ReplyReport, SearchPage, ManageHelpers, AddHelper, RemoveHelper,
+)
+
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -25,20 +55,90 @@ ADMINS = [a.strip().lower() for a in os.getenv("ADMINS", "mellfreezy").split(","
 SERVER_IP = os.getenv("SERVER_IP", "5.35.126.109:7486")
 FORUM_URL = os.getenv("FORUM_URL", "https://gameforum.hgweb.ru")
 
-DB_PATH = "dmarena.db"
+# polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Без явного секрета генерируется случайный: вебхук всё равно переустанавливается при старте
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+
+# Prometheus-эндпоинт /metrics; по умолчанию выключен (METRICS_PORT=0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+DB_PATH = os.getenv("DB_PATH", "dmarena.db")
+CHAT_REGISTRY_FLUSH_SECONDS = 5
+# Лимит Bot API на отправку файла ботом
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+db = Database(DB_PATH)
+storage = SQLiteStorage(db)
+update_pool = UpdateWorkerPool(UPDATE_WORKERS, UPDATE_QUEUE_SIZE)
+# FSM-middleware подключаем вручную после пула: состояние должно читаться
+# уже в воркере, когда предыдущие апдейты этого пользователя обработаны
+dp = Dispatcher(storage=storage, disable_fsm=True)
+dp.update.outer_middleware(update_pool)
+dp.update.outer_middleware(dp.fsm)
 router = Router()
 dp.include_router(router)
+# Все callback_query идут через таблицу действий (см. callbacks.py)
+callback_router = CallbackRouter()
+router.callback_query.register(callback_router.dispatch)
 
 scheduler = AsyncIOScheduler()
 
-_chat_id_cache = {}
+metrics = Metrics()
+db.observe = db_observer(metrics)
+bot.session.middleware(ApiMetricsMiddleware(metrics))
+metrics_runner = None
+
+staff_roster = StaffRoster(ADMINS)
+chat_registry = ChatRegistry(db)
+report_archive = ReportArchive(db)
+load_balancer = LoadBalancer()
+sla_stats = SlaStats()
+# Одна выгрузка за раз: каждая держит отдельное соединение и снимок базы
+export_lock = asyncio.Lock()
+sender = Sender(bot)
+
+# Отрисованные экраны: report_id -> (text, markup), user_id -> text.
+# Сбрасываются при изменении обращений (process_report, process_reply, cleanup).
+report_view_cache = LRUCache(1024)
+my_reports_cache = LRUCache(4096)
+# Растёт при каждой инвалидации: результат чтения, начатого до неё, не кэшируется
+render_epoch = 0
+
+
+def invalidate_views(report_ids=(), user_ids=()):
+    global render_epoch
+    render_epoch += 1
+    for rid in report_ids:
+        report_view_cache.pop(rid)
+    for user_id in user_ids:
+        my_reports_cache.pop(user_id)
+
+
+# ======================== FSM States ========================
+
+class ReportStates(StatesGroup):
+    waiting_for_problem = State()
+
+
+class ReplyStates(StatesGroup):
+    waiting_for_reply = State()
+
+
+class AddHelperStates(StatesGroup):
+    waiting_for_username = State()
 
 
 # ======================== Middleware ========================
@@ -50,128 +150,156 @@ class CacheChatIdMiddleware(BaseMiddleware):
         event,
         data: Dict[str, Any]
     ) -> Any:
+        # Пользователь без username тоже записывается: так сбрасывается его прежний
         if isinstance(event, Message):
-            if event.from_user and event.from_user.username:
-                _chat_id_cache[event.from_user.username.lower()] = event.chat.id
+            if event.from_user:
+                chat_registry.record(event.from_user.username, event.from_user.id, event.chat.id)
         elif isinstance(event, CallbackQuery):
-            if event.from_user and event.from_user.username and event.message:
-                _chat_id_cache[event.from_user.username.lower()] = event.message.chat.id
+            if event.from_user and event.message:
+                chat_registry.record(
+                    event.from_user.username, event.from_user.id, event.message.chat.id
+                )
+        user = event.from_user
+        staff_name = staff_roster.resolve(user.id, user.username) if user else None
+        if staff_name:
+            # Активность персонала — для назначения новых обращений
+            load_balancer.touch(staff_name)
         return await handler(event, data)
 
 
-router.message.middleware(CacheChatIdMiddleware())
-router.callback_query.middleware(CacheChatIdMiddleware())
-
-
-# ======================== FSM States ========================
-
-class ReportStates(StatesGroup):
-    waiting_for_problem = State()
-
-
-class ReplyStates(StatesGroup):
-    waiting_for_reply = State()
+# Лимиты действий: (токенов в секунду, ёмкость)
+THROTTLE_ACTIONS = {
+    CreateReport().pack(): (1 / 60, 3),
+    ReportStates.waiting_for_problem.state: (1 / 60, 3),
+    MyReports().pack(): (0.5, 5),
+}
 
+throttling = ThrottlingMiddleware(
+    actions=THROTTLE_ACTIONS,
+    exempt=lambda user: staff_roster.resolve(user.id, user.username) is not None,
+)
 
-class AddHelperStates(StatesGroup):
-    waiting_for_username = State()
+router.message.middleware(HandlerMetricsMiddleware(metrics))
+router.callback_query.middleware(HandlerMetricsMiddleware(metrics, resolve=callback_router.handler_name))
+router.message.middleware(CacheChatIdMiddleware())
+router.callback_query.middleware(CacheChatIdMiddleware())
+router.message.middleware(throttling)
+router.callback_query.middleware(throttling)
 
 
 # ======================== Database ========================
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                first_name TEXT,
-                message TEXT NOT NULL,
-                status TEXT DEFAULT 'open',
-                reply TEXT,
-                replied_by TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                replied_at TIMESTAMP,
-                notify_msg_ids TEXT DEFAULT ''
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS helpers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                added_by TEXT
-            )
-        """)
+    await run_migrations(db)
+    async with db.transaction() as conn:
         for admin in ADMINS:
             try:
-                await db.execute(
+                await conn.execute(
                     "INSERT OR IGNORE INTO helpers (username, added_by) VALUES (?, ?)",
                     (admin.lower(), "system")
                 )
             except Exception:
                 pass
-        await db.commit()
-
-
-async def is_staff(username: str) -> bool:
-    if not username:
-        return False
-    uname = username.lower()
-    if uname in ADMINS:
-        return True
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id FROM helpers WHERE username = ?", (uname,)
+
+
+async def report_counts():
+    """(открытых, отвеченных) из report_counters, которые ведут триггеры"""
+    rows = await db.fetchall("SELECT status, count FROM report_counters")
+    counts = dict(rows)
+    return counts.get("open", 0), counts.get("answered", 0)
+
+
+async def reconcile_report_counters():
+    """Сверяет report_counters с реальными COUNT(*) и исправляет расхождения"""
+    async with db.transaction() as conn:
+        async with conn.execute("SELECT status, COUNT(*) FROM reports GROUP BY status") as cursor:
+            actual = dict(await cursor.fetchall())
+        async with conn.execute("SELECT status, count FROM report_counters WHERE count != 0") as cursor:
+            stored = dict(await cursor.fetchall())
+        if actual == stored:
+            return
+        logger.warning(f"Report counters drifted: stored={stored}, actual={actual}")
+        await conn.execute("DELETE FROM report_counters")
+        await conn.executemany(
+            "INSERT INTO report_counters (status, count) VALUES (?, ?)", actual.items()
         )
-        row = await cursor.fetchone()
-        return row is not None
 
 
-async def is_admin(username: str) -> bool:
-    if not username:
-        return False
-    return username.lower() in ADMINS
+async def is_staff(user: User) -> bool:
+    return staff_roster.is_staff(user.id, user.username)
+
+
+async def is_admin(user: User) -> bool:
+    return staff_roster.is_admin(user.id, user.username)
 
 
 # ======================== Keyboards ========================
 
+# Статические клавиатуры собираются один раз при импорте
+
+MAIN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🛡 Поддержка", callback_data=Support().pack())],
+    [InlineKeyboardButton(text="🎮 Подключиться", callback_data=Connect().pack())],
+    [InlineKeyboardButton(text="🌐 Форум", url=FORUM_URL)],
+])
+
+SUPPORT_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📝 Создать обращение", callback_data=CreateReport().pack())],
+    [InlineKeyboardButton(text="📋 Мои обращения", callback_data=MyReports().pack())],
+    [InlineKeyboardButton(text="◀️ Назад в меню", callback_data=BackToMenu().pack())],
+])
+
+STAFF_PANEL_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📬 Открытые репорты", callback_data=StaffOpenReports().pack())],
+    [InlineKeyboardButton(text="✅ Отвеченные репорты", callback_data=StaffAnsweredReports().pack())],
+    [InlineKeyboardButton(text="👥 Управление помощниками", callback_data=ManageHelpers().pack())],
+    [InlineKeyboardButton(text="◀️ Назад в меню", callback_data=BackToMenu().pack())],
+])
+
+CONNECT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(
+        text="▶️ Подключиться к серверу",
+        url=f"https://server.sa-mp.com/{SERVER_IP}"
+    )],
+    [InlineKeyboardButton(text="◀️ Назад в меню", callback_data=BackToMenu().pack())]
+])
+
+CANCEL_REPORT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❌ Отмена", callback_data=Support().pack())]
+])
+
+CANCEL_REPLY_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❌ Отмена", callback_data=BackToPanel().pack())]
+])
+
+CANCEL_ADD_HELPER_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❌ Отмена", callback_data=ManageHelpers().pack())]
+])
+
+
 def main_menu_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🛡 Поддержка", callback_data="support")],
-        [InlineKeyboardButton(text="🎮 Подключиться", callback_data="connect")],
-        [InlineKeyboardButton(text="🌐 Форум", url=FORUM_URL)],
-    ])
+    return MAIN_MENU_KB
 
 
 def support_menu_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📝 Создать обращение", callback_data="create_report")],
-        [InlineKeyboardButton(text="📋 Мои обращения", callback_data="my_reports")],
-        [InlineKeyboardButton(text="◀️ Назад в меню", callback_data="back_to_menu")],
-    ])
+    return SUPPORT_MENU_KB
 
 
 def staff_panel_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📬 Открытые репорты", callback_data="staff_open_reports")],
-        [InlineKeyboardButton(text="✅ Отвеченные репорты", callback_data="staff_answered_reports")],
-        [InlineKeyboardButton(text="👥 Управление помощниками", callback_data="manage_helpers")],
-        [InlineKeyboardButton(text="◀️ Назад в меню", callback_data="back_to_menu")],
-    ])
+    return STAFF_PANEL_KB
 
 
 def report_action_keyboard(report_id: int, status: str) -> InlineKeyboardMarkup:
     buttons = []
     if status == "open":
         buttons.append([InlineKeyboardButton(
-            text="💬 Ответить", callback_data=f"reply_report_{report_id}"
+            text="💬 Ответить", callback_data=ReplyReport(report_id=report_id).pack()
         )])
     elif status == "answered":
         buttons.append([InlineKeyboardButton(
-            text="✏️ Изменить ответ", callback_data=f"reply_report_{report_id}"
+            text="✏️ Изменить ответ", callback_data=ReplyReport(report_id=report_id).pack()
         )])
-    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="staff_open_reports")])
+    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data=StaffOpenReports().pack())])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
@@ -211,46 +339,60 @@ WELCOME_TEXT = """
 
 # ======================== Notify Staff ========================
 
-async def notify_staff(report_id, user_id, username, first_name, problem_text):
+def pick_assignee():
+    """Наименее загруженный активный сотрудник с известным user_id или None"""
+    return load_balancer.pick(staff_roster.chat_ids())
+
+
+async def notify_staff(conn, report_id, user_id, username, first_name, problem_text,
+                       assignee=None, title="📬 Новое обращение", exclude=()):
+    """Ставит уведомления персоналу в outbox в транзакции обращения.
+
+    С assignee уведомление получает только он и обращение закрепляется
+    за ним; без — рассылка всему персоналу, кроме exclude.
+    """
     notify_text = (
-        f"<b>📬 Новое обращение #{report_id}</b>\n\n"
+        f"<b>{title} #{report_id}</b>\n\n"
         f"👤 <b>От:</b> {first_name} (@{username})\n"
         f"🆔 <b>User ID:</b> <code>{user_id}</code>\n\n"
         f"💬 <b>Сообщение:</b>\n<i>{problem_text}</i>"
     )
 
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💬 Ответить", callback_data=f"reply_report_{report_id}")],
+        [InlineKeyboardButton(text="💬 Ответить", callback_data=ReplyReport(report_id=report_id).pack())],
     ])
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT username FROM helpers")
-        helpers = await cursor.fetchall()
+    # Пишем в личку по user_id: сотрудники без привязки ещё не писали боту
+    staff_chats = staff_roster.chat_ids()
+    if assignee:
+        await conn.execute(
+            "UPDATE reports SET assigned_to = ?, assigned_at = ? WHERE id = ?",
+            (assignee, time.time(), report_id)
+        )
+        targets = [staff_chats[assignee]] if assignee in staff_chats else []
+    else:
+        targets = [chat_id for name, chat_id in staff_chats.items() if name not in exclude]
+
+    for chat_id in targets:
+        await Outbox.enqueue(
+            conn, "send", chat_id, text=notify_text, reply_markup=kb, report_id=report_id
+        )
 
-    all_staff = set(ADMINS)
-    for h in helpers:
-        all_staff.add(h[0].lower())
 
-    sent_msg_ids = []
+async def record_staff_notification(conn, job: OutboxJob, msg: Message):
+    """Сохраняет id доставленного уведомления, чтобы потом его править и удалять"""
+    await conn.execute(
+        "INSERT INTO report_notifications (report_id, chat_id, message_id) VALUES (?, ?, ?)",
+        (job.report_id, job.chat_id, msg.message_id)
+    )
 
-    for staff_uname in all_staff:
-        chat_id = _chat_id_cache.get(staff_uname)
-        if chat_id:
-            try:
-                msg = await bot.send_message(chat_id, notify_text, reply_markup=kb)
-                sent_msg_ids.append(f"{chat_id}:{msg.message_id}")
-            except Exception as e:
-                logger.error(f"Failed to notify @{staff_uname}: {e}")
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE reports SET notify_msg_ids = ? WHERE id = ?",
-            (",".join(sent_msg_ids), report_id)
-        )
-        await db.commit()
+outbox = Outbox(db, sender, on_sent=record_staff_notification)
 
 
 # ======================== Handlers ========================
+# Команды регистрируются раньше хендлеров состояний FSM: иначе команда,
+# отправленная в ожидании текста (ответ, новый помощник), уйдёт как этот текст
 
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
@@ -260,16 +402,12 @@ async def cmd_start(message: Message, state: FSMContext):
 
 @router.message(Command("panel"))
 async def cmd_panel(message: Message, state: FSMContext):
-    if not await is_staff(message.from_user.username):
+    if not await is_staff(message.from_user):
         await message.answer("❌ У вас нет доступа к панели.")
         return
     await state.clear()
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT COUNT(*) FROM reports WHERE status = 'open'")
-        open_count = (await cursor.fetchone())[0]
-        cursor = await db.execute("SELECT COUNT(*) FROM reports WHERE status = 'answered'")
-        answered_count = (await cursor.fetchone())[0]
+    open_count, answered_count = await report_counts()
 
     await message.answer(
         f"<b>🔧 Панель поддержки DMArena</b>\n\n"
@@ -280,16 +418,95 @@ async def cmd_panel(message: Message, state: FSMContext):
     )
 
 
-@router.callback_query(F.data == "back_to_menu")
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if not await is_admin(message.from_user):
+        await message.answer("❌ Команда доступна только администраторам.")
+        return
+    await message.answer(format_stats(metrics))
+
+
+@router.message(Command("sla"))
+async def cmd_sla(message: Message):
+    if not await is_admin(message.from_user):
+        await message.answer("❌ Команда доступна только администраторам.")
+        return
+    open_count, _ = await report_counts()
+    await message.answer(format_sla(sla_stats, open_count))
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    if not await is_admin(message.from_user):
+        await message.answer("❌ Команда доступна только администраторам.")
+        return
+
+    try:
+        fmt, status, since, until = parse_export_args(command.args or "")
+    except ValueError:
+        await message.answer(EXPORT_USAGE)
+        return
+
+    if export_lock.locked():
+        await message.answer("⏳ Другая выгрузка ещё готовится, попробуйте позже.")
+        return
+
+    async with export_lock:
+        await message.answer("⏳ Готовлю выгрузку...")
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+        os.close(fd)
+        try:
+            started = time.perf_counter()
+            count = await export_reports(db, path, fmt, status, since, until)
+            size = os.path.getsize(path)
+            logger.info(
+                f"Export {fmt} status={status} since={since} until={until}: "
+                f"{count} rows, {size} bytes in {time.perf_counter() - started:.2f}s"
+            )
+            if size > EXPORT_MAX_BYTES:
+                await message.answer(
+                    "❌ Файл больше 50 МБ — Telegram его не примет. Сузьте период или статус."
+                )
+                return
+            filename = f"reports_{datetime.now():%Y%m%d_%H%M%S}.{fmt}.gz"
+            await message.answer_document(
+                FSInputFile(path, filename=filename),
+                caption=f"📦 Обращений: <b>{count}</b>"
+            )
+        finally:
+            os.remove(path)
+
+
+@router.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject, state: FSMContext):
+    if not await is_staff(message.from_user):
+        await message.answer("❌ У вас нет доступа к поиску.")
+        return
+
+    query = (command.args or "").strip()
+    if not build_fts_query(query):
+        await message.answer(
+            "<b>🔎 Поиск по обращениям</b>\n\n"
+            "Использование: <code>/search текст</code>\n"
+            "Ищет по тексту обращений и ответов, слова можно сокращать."
+        )
+        return
+
+    # Запрос хранится в данных FSM: в callback_data для пагинации он не помещается
+    await state.update_data(search_query=query)
+    text, kb = await show_search_results(query, 0)
+    await message.answer(text, reply_markup=kb)
+
+
+@callback_router.route(BackToMenu)
 async def cb_back_to_menu(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text(WELCOME_TEXT, reply_markup=main_menu_keyboard())
     await callback.answer()
 
 
-@router.callback_query(F.data == "connect")
+@callback_router.route(Connect)
 async def cb_connect(callback: CallbackQuery):
-    ip, port = SERVER_IP.split(":")
     connect_text = (
         f"<b>🎮 Подключение к серверу DMArena</b>\n\n"
         f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
@@ -298,18 +515,11 @@ async def cb_connect(callback: CallbackQuery):
         f"подключения через SA:MP клиент.\n\n"
         f"━━━━━━━━━━━━━━━━━━━━━━"
     )
-    connect_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(
-            text="▶️ Подключиться к серверу",
-            url=f"https://server.sa-mp.com/{ip}:{port}"
-        )],
-        [InlineKeyboardButton(text="◀️ Назад в меню", callback_data="back_to_menu")]
-    ])
-    await callback.message.edit_text(connect_text, reply_markup=connect_kb)
+    await callback.message.edit_text(connect_text, reply_markup=CONNECT_KB)
     await callback.answer()
 
 
-@router.callback_query(F.data == "support")
+@callback_router.route(Support)
 async def cb_support(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text(
@@ -322,16 +532,14 @@ async def cb_support(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(F.data == "create_report")
+@callback_router.route(CreateReport)
 async def cb_create_report(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "<b>📝 Создание обращения</b>\n\n"
         "Опишите вашу проблему или вопрос в <b>одном сообщении</b>.\n"
         "Постарайтесь описать ситуацию максимально подробно.\n\n"
         "<i>Отправьте сообщение ниже ⬇️</i>",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="support")]
-        ])
+        reply_markup=CANCEL_REPORT_KB
     )
     await state.set_state(ReportStates.waiting_for_problem)
     await callback.answer()
@@ -348,13 +556,33 @@ async def process_report(message: Message, state: FSMContext):
     username = message.from_user.username or "нет_юзернейма"
     first_name = message.from_user.first_name or "Аноним"
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
+    # Нагрузка учитывается до записи, чтобы параллельные обращения
+    # не ушли одному и тому же сотруднику
+    assignee = pick_assignee()
+    if assignee:
+        load_balancer.assign(assignee)
+
+    async def save_report(conn):
+        cursor = await conn.execute(
             "INSERT INTO reports (user_id, username, first_name, message) VALUES (?, ?, ?, ?)",
             (user_id, username, first_name, problem_text)
         )
-        report_id = cursor.lastrowid
-        await db.commit()
+        await notify_staff(
+            conn, cursor.lastrowid, user_id, username, first_name, problem_text,
+            assignee=assignee, title="📌 Вам назначено обращение" if assignee else "📬 Новое обращение"
+        )
+        return cursor.lastrowid
+
+    # Обращение и уведомления персоналу — одной записью в групповом коммите
+    try:
+        report_id = await db.write(save_report)
+    except Exception:
+        if assignee:
+            load_balancer.release(assignee)
+        raise
+    outbox.wake()
+    invalidate_views(user_ids=[user_id])
+    sla_stats.record_created()
 
     await state.clear()
 
@@ -366,26 +594,10 @@ async def process_report(message: Message, state: FSMContext):
         reply_markup=main_menu_keyboard()
     )
 
-    await notify_staff(report_id, user_id, username, first_name, problem_text)
-
-
-@router.callback_query(F.data == "my_reports")
-async def cb_my_reports(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id, message, status, reply FROM reports WHERE user_id = ? ORDER BY id DESC LIMIT 10",
-            (user_id,)
-        )
-        reports = await cursor.fetchall()
 
+def render_my_reports(reports) -> str:
     if not reports:
-        await callback.message.edit_text(
-            "<b>📋 Мои обращения</b>\n\nУ вас пока нет обращений.",
-            reply_markup=support_menu_keyboard()
-        )
-        await callback.answer()
-        return
+        return "<b>📋 Мои обращения</b>\n\nУ вас пока нет обращений."
 
     text = "<b>📋 Мои обращения</b>\n\n"
     for r in reports:
@@ -395,23 +607,110 @@ async def cb_my_reports(callback: CallbackQuery):
         if reply:
             text += f"   ↳ <i>Ответ: {reply[:60]}{'...' if len(reply) > 60 else ''}</i>\n"
         text += "\n"
+    return text
+
+
+@callback_router.route(MyReports)
+async def cb_my_reports(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    text = my_reports_cache.get(user_id)
+    if text is None:
+        epoch = render_epoch
+        reports = await db.fetchall(
+            "SELECT id, message, status, reply FROM reports WHERE user_id = ? ORDER BY id DESC LIMIT 10",
+            (user_id,)
+        )
+        # Старые отвеченные обращения лежат в архиве: добираем последние оттуда
+        reports += await report_archive.by_user(user_id, 10)
+        reports = sorted(reports, key=lambda r: r[0], reverse=True)[:10]
+        text = render_my_reports(reports)
+        if epoch == render_epoch:
+            my_reports_cache.set(user_id, text)
 
     await callback.message.edit_text(text, reply_markup=support_menu_keyboard())
     await callback.answer()
   # ======================== Staff Handlers ========================
 
-@router.callback_query(F.data == "staff_open_reports")
-async def cb_staff_open_reports(callback: CallbackQuery):
-    if not await is_staff(callback.from_user.username):
-        await callback.answer("❌ Нет доступа", show_alert=True)
-        return
+REPORTS_PAGE_SIZE = 10
+
+
+def _ts_to_cursor(ts: str) -> str:
+    # "2024-05-01 12:30:00" -> "20240501123000": короче и без ":" для callback_data
+    return "".join(ch for ch in ts if ch.isdigit())
+
+
+def _cursor_to_ts(cursor: str) -> str:
+    return f"{cursor[:4]}-{cursor[4:6]}-{cursor[6:8]} {cursor[8:10]}:{cursor[10:12]}:{cursor[12:14]}"
+
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id, user_id, username, first_name, message "
-            "FROM reports WHERE status = 'open' ORDER BY id DESC"
+async def fetch_open_page(before_id=None, after_id=None):
+    """Страница открытых обращений по ключу id (без OFFSET и полного скана)"""
+    if after_id is not None:
+        rows = await db.fetchall(
+            "SELECT id, first_name, message FROM reports "
+            "WHERE status = 'open' AND id > ? ORDER BY id ASC LIMIT ?",
+            (after_id, REPORTS_PAGE_SIZE + 1)
         )
-        reports = await cursor.fetchall()
+        has_more = len(rows) > REPORTS_PAGE_SIZE
+        rows = rows[:REPORTS_PAGE_SIZE][::-1]
+        return rows, has_more, True
+    if before_id is not None:
+        rows = await db.fetchall(
+            "SELECT id, first_name, message FROM reports "
+            "WHERE status = 'open' AND id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, REPORTS_PAGE_SIZE + 1)
+        )
+    else:
+        rows = await db.fetchall(
+            "SELECT id, first_name, message FROM reports "
+            "WHERE status = 'open' ORDER BY id DESC LIMIT ?",
+            (REPORTS_PAGE_SIZE + 1,)
+        )
+    return rows[:REPORTS_PAGE_SIZE], before_id is not None, len(rows) > REPORTS_PAGE_SIZE
+
+
+async def fetch_answered_page(before=None, after=None):
+    """Страница отвеченных обращений по ключу (replied_at, id)"""
+    if after is not None:
+        rows = await db.fetchall(
+            "SELECT id, first_name, message, replied_at FROM reports "
+            "WHERE status = 'answered' AND (replied_at, id) > (?, ?) "
+            "ORDER BY replied_at ASC, id ASC LIMIT ?",
+            (*after, REPORTS_PAGE_SIZE + 1)
+        )
+        has_more = len(rows) > REPORTS_PAGE_SIZE
+        rows = rows[:REPORTS_PAGE_SIZE][::-1]
+        return rows, has_more, True
+    if before is not None:
+        rows = await db.fetchall(
+            "SELECT id, first_name, message, replied_at FROM reports "
+            "WHERE status = 'answered' AND (replied_at, id) < (?, ?) "
+            "ORDER BY replied_at DESC, id DESC LIMIT ?",
+            (*before, REPORTS_PAGE_SIZE + 1)
+        )
+    else:
+        rows = await db.fetchall(
+            "SELECT id, first_name, message, replied_at FROM reports "
+            "WHERE status = 'answered' ORDER BY replied_at DESC, id DESC LIMIT ?",
+            (REPORTS_PAGE_SIZE + 1,)
+        )
+    return rows[:REPORTS_PAGE_SIZE], before is not None, len(rows) > REPORTS_PAGE_SIZE
+
+
+def pager_row(prev_data, next_data):
+    row = []
+    if prev_data:
+        row.append(InlineKeyboardButton(text="⬅️", callback_data=prev_data))
+    if next_data:
+        row.append(InlineKeyboardButton(text="➡️", callback_data=next_data))
+    return row
+
+
+async def show_open_reports(callback: CallbackQuery, before_id=None, after_id=None):
+    reports, has_prev, has_next = await fetch_open_page(before_id, after_id)
+    if not reports and (before_id or after_id):
+        # Курсор устарел (обращения закрыли или удалили) — начинаем с первой страницы
+        reports, has_prev, has_next = await fetch_open_page()
 
     if not reports:
         await callback.message.edit_text(
@@ -421,35 +720,35 @@ async def cb_staff_open_reports(callback: CallbackQuery):
         await callback.answer()
         return
 
+    total, _ = await report_counts()
+
     buttons = []
     for r in reports:
-        rid, uid, uname, fname, msg = r
+        rid, fname, msg = r
         preview = msg[:40] + "..." if len(msg) > 40 else msg
         buttons.append([InlineKeyboardButton(
             text=f"🟡 #{rid} | {fname} — {preview}",
-            callback_data=f"view_report_{rid}"
+            callback_data=ViewReport(report_id=rid).pack()
         )])
-    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_panel")])
+    pager = pager_row(
+        OpenPage(direction="p", report_id=reports[0][0]).pack() if has_prev else None,
+        OpenPage(direction="n", report_id=reports[-1][0]).pack() if has_next else None,
+    )
+    if pager:
+        buttons.append(pager)
+    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data=BackToPanel().pack())])
 
     await callback.message.edit_text(
-        "<b>📬 Открытые обращения</b>\n\nНажмите на обращение для просмотра:",
+        f"<b>📬 Открытые обращения</b> (всего: {total})\n\nНажмите на обращение для просмотра:",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
     )
     await callback.answer()
 
 
-@router.callback_query(F.data == "staff_answered_reports")
-async def cb_staff_answered(callback: CallbackQuery):
-    if not await is_staff(callback.from_user.username):
-        await callback.answer("❌ Нет доступа", show_alert=True)
-        return
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id, username, first_name, message, reply, replied_by "
-            "FROM reports WHERE status = 'answered' ORDER BY replied_at DESC"
-        )
-        reports = await cursor.fetchall()
+async def show_answered_reports(callback: CallbackQuery, before=None, after=None):
+    reports, has_prev, has_next = await fetch_answered_page(before, after)
+    if not reports and (before or after):
+        reports, has_prev, has_next = await fetch_answered_page()
 
     if not reports:
         await callback.message.edit_text(
@@ -459,35 +758,84 @@ async def cb_staff_answered(callback: CallbackQuery):
         await callback.answer()
         return
 
+    _, total = await report_counts()
+
     buttons = []
     for r in reports:
-        rid, uname, fname, msg, reply, replied_by = r
+        rid, fname, msg, replied_at = r
         preview = msg[:30] + "..." if len(msg) > 30 else msg
         buttons.append([InlineKeyboardButton(
             text=f"✅ #{rid} | {fname} — {preview}",
-            callback_data=f"view_report_{rid}"
+            callback_data=ViewReport(report_id=rid).pack()
         )])
-    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_panel")])
+    first, last = reports[0], reports[-1]
+    pager = pager_row(
+        AnsweredPage(direction="p", ts=_ts_to_cursor(first[3]), report_id=first[0]).pack()
+        if has_prev else None,
+        AnsweredPage(direction="n", ts=_ts_to_cursor(last[3]), report_id=last[0]).pack()
+        if has_next else None,
+    )
+    if pager:
+        buttons.append(pager)
+    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data=BackToPanel().pack())])
 
     await callback.message.edit_text(
-        "<b>✅ Отвеченные обращения</b>\n\nНажмите для просмотра (можно изменить ответ):",
+        f"<b>✅ Отвеченные обращения</b> (всего: {total})\n\n"
+        "Нажмите для просмотра (можно изменить ответ):",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
     )
     await callback.answer()
 
 
-@router.callback_query(F.data == "back_to_panel")
+@callback_router.route(StaffOpenReports)
+async def cb_staff_open_reports(callback: CallbackQuery):
+    if not await is_staff(callback.from_user):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    await show_open_reports(callback)
+
+
+@callback_router.route(OpenPage)
+async def cb_staff_open_page(callback: CallbackQuery, callback_data: OpenPage):
+    if not await is_staff(callback.from_user):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+
+    if callback_data.direction == "p":
+        await show_open_reports(callback, after_id=callback_data.report_id)
+    else:
+        await show_open_reports(callback, before_id=callback_data.report_id)
+
+
+@callback_router.route(StaffAnsweredReports)
+async def cb_staff_answered(callback: CallbackQuery):
+    if not await is_staff(callback.from_user):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    await show_answered_reports(callback)
+
+
+@callback_router.route(AnsweredPage)
+async def cb_staff_answered_page(callback: CallbackQuery, callback_data: AnsweredPage):
+    if not await is_staff(callback.from_user):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+
+    key = (_cursor_to_ts(callback_data.ts), callback_data.report_id)
+    if callback_data.direction == "p":
+        await show_answered_reports(callback, after=key)
+    else:
+        await show_answered_reports(callback, before=key)
+
+
+@callback_router.route(BackToPanel)
 async def cb_back_to_panel(callback: CallbackQuery, state: FSMContext):
-    if not await is_staff(callback.from_user.username):
+    if not await is_staff(callback.from_user):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     await state.clear()
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT COUNT(*) FROM reports WHERE status = 'open'")
-        open_count = (await cursor.fetchone())[0]
-        cursor = await db.execute("SELECT COUNT(*) FROM reports WHERE status = 'answered'")
-        answered_count = (await cursor.fetchone())[0]
+    open_count, answered_count = await report_counts()
 
     await callback.message.edit_text(
         f"<b>🔧 Панель поддержки DMArena</b>\n\n"
@@ -500,28 +848,9 @@ async def cb_back_to_panel(callback: CallbackQuery, state: FSMContext):
 
 # ======================== View Report ========================
 
-@router.callback_query(F.data.startswith("view_report_"))
-async def cb_view_report(callback: CallbackQuery):
-    if not await is_staff(callback.from_user.username):
-        await callback.answer("❌ Нет доступа", show_alert=True)
-        return
-
-    report_id = int(callback.data.split("_")[2])
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id, user_id, username, first_name, message, status, reply, "
-            "replied_by, created_at, replied_at FROM reports WHERE id = ?",
-            (report_id,)
-        )
-        report = await cursor.fetchone()
-
-    if not report:
-        await callback.answer("Обращение не найдено", show_alert=True)
-        return
-
+def render_report_view(report):
     rid, uid, uname, fname, msg, status, reply, replied_by, created, replied_at = report
-    status_text = "🟡 Открыт" if status == "open" else "✅ Отвечен"
+    status_text = {"open": "🟡 Открыт", "archived": "📦 В архиве"}.get(status, "✅ Отвечен")
 
     text = (
         f"<b>📄 Обращение #{rid}</b>\n\n"
@@ -540,19 +869,143 @@ async def cb_view_report(callback: CallbackQuery):
             f"📅 <b>Отвечено:</b> {replied_at}"
         )
 
-    await callback.message.edit_text(text, reply_markup=report_action_keyboard(rid, status))
+    return text, report_action_keyboard(rid, status)
+
+
+@callback_router.route(ViewReport)
+async def cb_view_report(callback: CallbackQuery, callback_data: ViewReport):
+    if not await is_staff(callback.from_user):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+
+    report_id = callback_data.report_id
+
+    view = report_view_cache.get(report_id)
+    if view is None:
+        epoch = render_epoch
+        report = await db.fetchone(
+            "SELECT id, user_id, username, first_name, message, status, reply, "
+            "replied_by, created_at, replied_at FROM reports WHERE id = ?",
+            (report_id,)
+        )
+        if not report:
+            report = await report_archive.get(report_id)
+
+        if not report:
+            await callback.answer("Обращение не найдено", show_alert=True)
+            return
+
+        view = render_report_view(report)
+        if epoch == render_epoch:
+            report_view_cache.set(report_id, view)
+
+    text, kb = view
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+
+# ======================== Search ========================
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_TERMS = 8
+SEARCH_WORD_RE = re.compile(r"\w+")
+
+
+def build_fts_query(text: str):
+    """Запрос пользователя -> выражение MATCH: слова по префиксу, все обязательны.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 и спецсимволы
+    из запроса не интерпретируются.
+    """
+    words = SEARCH_WORD_RE.findall(text.lower())[:SEARCH_MAX_TERMS]
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+async def fetch_search_page(fts_query: str, page: int):
+    """Страница найденных обращений (рабочих и архивных) по релевантности (bm25)"""
+    rows = await db.fetchall(
+        "SELECT id, first_name, status, snippet, data FROM ("
+        "SELECT r.id, r.first_name, r.status, "
+        "snippet(reports_fts, -1, '', '', '…', 8) AS snippet, NULL AS data, reports_fts.rank AS rank "
+        "FROM reports_fts JOIN reports r ON r.id = reports_fts.rowid "
+        "WHERE reports_fts MATCH ? "
+        "UNION ALL "
+        "SELECT a.id, NULL, 'archived', NULL, a.data, reports_archive_fts.rank "
+        "FROM reports_archive_fts JOIN reports_archive a ON a.id = reports_archive_fts.rowid "
+        "WHERE reports_archive_fts MATCH ?"
+        ") ORDER BY rank LIMIT ? OFFSET ?",
+        (fts_query, fts_query, SEARCH_PAGE_SIZE + 1, page * SEARCH_PAGE_SIZE)
+    )
+    results = []
+    for rid, fname, status, snippet, data in rows[:SEARCH_PAGE_SIZE]:
+        if data is not None:
+            # Архивный индекс не хранит текст: вместо сниппета — начало сообщения
+            _, fname, snippet, _, _ = unpack_archived(data)
+        results.append((rid, fname, status, snippet))
+    return results, len(rows) > SEARCH_PAGE_SIZE
+
+
+async def show_search_results(query: str, page: int):
+    """(text, markup) страницы результатов поиска"""
+    fts_query = build_fts_query(query)
+    reports, has_next = await fetch_search_page(fts_query, page) if fts_query else ([], False)
+
+    if not reports:
+        return (
+            f"<b>🔎 Поиск:</b> <i>{html.quote(query)}</i>\n\nНичего не найдено.",
+            staff_panel_keyboard()
+        )
+
+    buttons = []
+    for r in reports:
+        rid, fname, status, snippet = r
+        status_icon = "🟡" if status == "open" else "✅"
+        preview = snippet[:40] + "..." if len(snippet) > 40 else snippet
+        buttons.append([InlineKeyboardButton(
+            text=f"{status_icon} #{rid} | {fname} — {preview}",
+            callback_data=ViewReport(report_id=rid).pack()
+        )])
+    pager = pager_row(
+        SearchPage(page=page - 1).pack() if page else None,
+        SearchPage(page=page + 1).pack() if has_next else None,
+    )
+    if pager:
+        buttons.append(pager)
+    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data=BackToPanel().pack())])
+
+    return (
+        f"<b>🔎 Поиск:</b> <i>{html.quote(query)}</i> (стр. {page + 1})\n\n"
+        "Нажмите на обращение для просмотра:",
+        InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+
+@callback_router.route(SearchPage)
+async def cb_search_page(callback: CallbackQuery, callback_data: SearchPage, state: FSMContext):
+    if not await is_staff(callback.from_user):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /search", show_alert=True)
+        return
+
+    page = callback_data.page
+    text, kb = await show_search_results(query, page)
+    await callback.message.edit_text(text, reply_markup=kb)
     await callback.answer()
 
 
 # ======================== Reply to Report ========================
 
-@router.callback_query(F.data.startswith("reply_report_"))
-async def cb_reply_report(callback: CallbackQuery, state: FSMContext):
-    if not await is_staff(callback.from_user.username):
+@callback_router.route(ReplyReport)
+async def cb_reply_report(callback: CallbackQuery, callback_data: ReplyReport, state: FSMContext):
+    if not await is_staff(callback.from_user):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
 
-    report_id = int(callback.data.split("_")[2])
+    report_id = callback_data.report_id
     await state.set_state(ReplyStates.waiting_for_reply)
     await state.update_data(report_id=report_id)
 
@@ -560,16 +1013,14 @@ async def cb_reply_report(callback: CallbackQuery, state: FSMContext):
         f"<b>💬 Ответ на обращение #{report_id}</b>\n\n"
         "Напишите ваш ответ пользователю в <b>одном сообщении</b>.\n\n"
         "<i>Отправьте ответ ниже ⬇️</i>",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="back_to_panel")]
-        ])
+        reply_markup=CANCEL_REPLY_KB
     )
     await callback.answer()
 
 
 @router.message(ReplyStates.waiting_for_reply)
 async def process_reply(message: Message, state: FSMContext):
-    if not await is_staff(message.from_user.username):
+    if not await is_staff(message.from_user):
         return
 
     reply_text = message.text
@@ -581,73 +1032,78 @@ async def process_reply(message: Message, state: FSMContext):
     report_id = data.get("report_id")
     replied_by = message.from_user.username or "unknown"
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT user_id, username, first_name, message, notify_msg_ids "
-            "FROM reports WHERE id = ?",
+    async def save_reply(conn):
+        async with conn.execute(
+            "SELECT user_id, username, first_name, message, status, assigned_to, "
+            "strftime('%s', created_at) FROM reports WHERE id = ?",
             (report_id,)
-        )
-        report = await cursor.fetchone()
+        ) as cursor:
+            report = await cursor.fetchone()
 
-        if not report:
-            await message.answer("❌ Обращение не найдено.")
-            await state.clear()
-            return
+        if report:
+            user_id, uname, fname, original_msg, _, _, _ = report
 
-        user_id, uname, fname, original_msg, notify_msg_ids = report
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            await conn.execute(
+                "UPDATE reports SET status = 'answered', reply = ?, "
+                "replied_by = ?, replied_at = ? WHERE id = ?",
+                (reply_text, replied_by, now, report_id)
+            )
 
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        await db.execute(
-            "UPDATE reports SET status = 'answered', reply = ?, "
-            "replied_by = ?, replied_at = ? WHERE id = ?",
-            (reply_text, replied_by, now, report_id)
-        )
-        await db.commit()
+            # Уведомляем пользователя
+            user_notify_text = (
+                f"<b>✅ Ответ на ваше обращение #{report_id}</b>\n\n"
+                f"📝 <b>Ваш вопрос:</b>\n<i>{original_msg}</i>\n\n"
+                f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
+                f"💬 <b>Ответ от поддержки:</b>\n<i>{reply_text}</i>\n\n"
+                f"<i>Спасибо за обращение! Если проблема не решена,\n"
+                f"создайте новое обращение.</i>"
+            )
+            await Outbox.enqueue(
+                conn, "send", user_id, text=user_notify_text, reply_markup=main_menu_keyboard()
+            )
 
-    await state.clear()
+            # Обновляем уведомления у персонала (и те, что ещё не доставлены)
+            updated_text = (
+                f"<b>✅ Обращение #{report_id} — ОТВЕЧЕНО</b>\n\n"
+                f"👤 <b>От:</b> {fname} (@{uname})\n\n"
+                f"💬 <b>Вопрос:</b>\n<i>{original_msg}</i>\n\n"
+                f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
+                f"✅ <b>Ответ от</b> @{replied_by}:\n<i>{reply_text}</i>"
+            )
+            updated_kb = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(
+                    text="✏️ Изменить ответ",
+                    callback_data=ReplyReport(report_id=report_id).pack()
+                )]
+            ])
+            await Outbox.enqueue_from_query(
+                conn, "edit",
+                "SELECT chat_id, message_id FROM report_notifications WHERE report_id = ?",
+                (report_id,), text=updated_text, reply_markup=updated_kb
+            )
+            await Outbox.replace_pending(conn, report_id, updated_text, updated_kb)
+        return report
 
-    # Уведомляем пользователя
-    try:
-        user_notify_text = (
-            f"<b>✅ Ответ на ваше обращение #{report_id}</b>\n\n"
-            f"📝 <b>Ваш вопрос:</b>\n<i>{original_msg}</i>\n\n"
-            f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"💬 <b>Ответ от поддержки:</b>\n<i>{reply_text}</i>\n\n"
-            f"<i>Спасибо за обращение! Если проблема не решена,\n"
-            f"создайте новое обращение.</i>"
-        )
-        await bot.send_message(
-            user_id, user_notify_text, reply_markup=main_menu_keyboard()
-        )
-    except Exception as e:
-        logger.error(f"Не удалось уведомить пользователя {user_id}: {e}")
-
-    # Обновляем уведомления у персонала
-    if notify_msg_ids:
-        for item in notify_msg_ids.split(","):
-            if ":" in item:
-                try:
-                    chat_id, msg_id = item.split(":")
-                    updated_text = (
-                        f"<b>✅ Обращение #{report_id} — ОТВЕЧЕНО</b>\n\n"
-                        f"👤 <b>От:</b> {fname} (@{uname})\n\n"
-                        f"💬 <b>Вопрос:</b>\n<i>{original_msg}</i>\n\n"
-                        f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
-                        f"✅ <b>Ответ от</b> @{replied_by}:\n<i>{reply_text}</i>"
-                    )
-                    await bot.edit_message_text(
-                        updated_text,
-                        chat_id=int(chat_id),
-                        message_id=int(msg_id),
-                        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(
-                                text="✏️ Изменить ответ",
-                                callback_data=f"reply_report_{report_id}"
-                            )]
-                        ])
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to update notification: {e}")
+    report = await db.write(save_reply)
+    outbox.wake()
+    invalidate_views([report_id], [report[0]] if report else [])
+
+    if not report:
+        await message.answer("❌ Обращение не найдено.")
+        await state.clear()
+        return
+
+    _, uname, fname, _, status, assigned_to, created_ts = report
+    if status == "open":
+        # Правка уже отвеченного обращения в статистику не попадает.
+        # Ключ — запись helpers (привязана к user_id), а не текущий username
+        staff_name = staff_roster.resolve(message.from_user.id, message.from_user.username)
+        sla_stats.record_reply(float(created_ts), staff_name or replied_by)
+        if assigned_to:
+            load_balancer.release(assigned_to)
+
+    await state.clear()
 
     await message.answer(
         f"<b>✅ Ответ на обращение #{report_id} отправлен!</b>\n\n"
@@ -658,18 +1114,19 @@ async def process_reply(message: Message, state: FSMContext):
 
 # ======================== Manage Helpers ========================
 
-@router.callback_query(F.data == "manage_helpers")
+# Username в Telegram: 5–32 символа из латиницы, цифр и "_"
+USERNAME_RE = re.compile(r"[a-z0-9_]{5,32}")
+
+@callback_router.route(ManageHelpers)
 async def cb_manage_helpers(callback: CallbackQuery):
-    if not await is_admin(callback.from_user.username):
+    if not await is_admin(callback.from_user):
         await callback.answer(
             "❌ Только администраторы могут управлять помощниками",
             show_alert=True
         )
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT username, added_by FROM helpers")
-        helpers = await cursor.fetchall()
+    helpers = await db.fetchall("SELECT username, added_by FROM helpers")
 
     text = "<b>👥 Управление помощниками</b>\n\n"
 
@@ -687,16 +1144,22 @@ async def cb_manage_helpers(callback: CallbackQuery):
         text += "Нет помощников.\n"
 
     buttons = [
-        [InlineKeyboardButton(text="➕ Добавить помощника", callback_data="add_helper")],
+        [InlineKeyboardButton(text="➕ Добавить помощника", callback_data=AddHelper().pack())],
     ]
     for h in helpers:
         if h[0] not in ADMINS:
+            try:
+                remove_data = RemoveHelper(username=h[0]).pack()
+            except ValueError:
+                # Запись, добавленная до проверки username, в callback_data не помещается
+                logger.warning(f"Helper {h[0]!r} cannot be removed from the panel")
+                continue
             buttons.append([InlineKeyboardButton(
                 text=f"❌ Удалить @{h[0]}",
-                callback_data=f"remove_helper_{h[0]}"
+                callback_data=remove_data
             )])
     buttons.append([
-        InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_panel")
+        InlineKeyboardButton(text="◀️ Назад", callback_data=BackToPanel().pack())
     ])
 
     await callback.message.edit_text(
@@ -705,9 +1168,9 @@ async def cb_manage_helpers(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data == "add_helper")
+@callback_router.route(AddHelper)
 async def cb_add_helper(callback: CallbackQuery, state: FSMContext):
-    if not await is_admin(callback.from_user.username):
+    if not await is_admin(callback.from_user):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
 
@@ -716,114 +1179,316 @@ async def cb_add_helper(callback: CallbackQuery, state: FSMContext):
         "<b>➕ Добавление помощника</b>\n\n"
         "Введите <b>username</b> нового помощника (без @).\n\n"
         "<i>Отправьте username ниже ⬇️</i>",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="manage_helpers")]
-        ])
+        reply_markup=CANCEL_ADD_HELPER_KB
     )
     await callback.answer()
 
 
 @router.message(AddHelperStates.waiting_for_username)
 async def process_add_helper(message: Message, state: FSMContext):
-    if not await is_admin(message.from_user.username):
+    if not await is_admin(message.from_user):
         return
 
-    username = message.text.strip().replace("@", "").lower()
-    if not username:
+    username = (message.text or "").strip().replace("@", "").lower()
+    if not USERNAME_RE.fullmatch(username):
         await message.answer("❌ Введите корректный username.")
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            await db.execute(
-                "INSERT INTO helpers (username, added_by) VALUES (?, ?)",
-                (username, message.from_user.username)
-            )
-            await db.commit()
-            await state.clear()
-            await message.answer(
-                f"<b>✅ Помощник @{username} добавлен!</b>",
-                reply_markup=staff_panel_keyboard()
-            )
-        except aiosqlite.IntegrityError:
-            await message.answer(
-                f"❌ @{username} уже является помощником.",
-                reply_markup=staff_panel_keyboard()
-            )
-            await state.clear()
+    # Если пользователь уже писал боту, сразу привязываем его user_id
+    user_id = chat_registry.user_id(username)
+    try:
+        await db.execute(
+            "INSERT INTO helpers (username, added_by, user_id) VALUES (?, ?, ?)",
+            (username, message.from_user.username, user_id)
+        )
+        staff_roster.add(username, user_id)
+        await state.clear()
+        await message.answer(
+            f"<b>✅ Помощник @{username} добавлен!</b>",
+            reply_markup=staff_panel_keyboard()
+        )
+    except aiosqlite.IntegrityError:
+        await message.answer(
+            f"❌ @{username} уже является помощником.",
+            reply_markup=staff_panel_keyboard()
+        )
+        await state.clear()
 
 
-@router.callback_query(F.data.startswith("remove_helper_"))
-async def cb_remove_helper(callback: CallbackQuery):
-    if not await is_admin(callback.from_user.username):
+@callback_router.route(RemoveHelper)
+async def cb_remove_helper(callback: CallbackQuery, callback_data: RemoveHelper):
+    if not await is_admin(callback.from_user):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
 
-    username = callback.data.replace("remove_helper_", "")
+    username = callback_data.username
 
     if username in ADMINS:
         await callback.answer("❌ Нельзя удалить администратора", show_alert=True)
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM helpers WHERE username = ?", (username,))
-        await db.commit()
+    await db.execute("DELETE FROM helpers WHERE username = ?", (username,))
+    staff_roster.remove(username)
+    load_balancer.forget(username)
+    # Его открытые обращения уйдут всем при ближайшей проверке назначений
+    await db.execute(
+        "UPDATE reports SET assigned_at = 0 WHERE status = 'open' AND assigned_to = ?",
+        (username,)
+    )
 
     await callback.answer(f"✅ @{username} удалён из помощников", show_alert=True)
     await cb_manage_helpers(callback)
 
 
+# ======================== Assignment ========================
+
+ESCALATION_BATCH_SIZE = 100
+
+
+async def escalate_stale_assignments():
+    """Назначенные и не отвеченные за ASSIGNMENT_TIMEOUT обращения — всему персоналу"""
+    deadline = time.time() - ASSIGNMENT_TIMEOUT
+    # Выборка в той же транзакции: обращение, на которое уже ответили, не разошлётся
+    async with db.transaction() as conn:
+        async with conn.execute(
+            "SELECT id, user_id, username, first_name, message, assigned_to FROM reports "
+            "WHERE status = 'open' AND assigned_at <= ? ORDER BY assigned_at LIMIT ?",
+            (deadline, ESCALATION_BATCH_SIZE)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        for rid, uid, uname, fname, msg, assigned_to in rows:
+            await notify_staff(
+                conn, rid, uid, uname, fname, msg,
+                title="⏰ Обращение ждёт ответа", exclude=(assigned_to,)
+            )
+            await conn.execute(
+                "UPDATE reports SET assigned_to = NULL, assigned_at = NULL WHERE id = ?", (rid,)
+            )
+    if not rows:
+        return 0
+    for row in rows:
+        load_balancer.release(row[5])
+    outbox.wake()
+    logger.info(f"Escalated {len(rows)} stale assignments")
+    return len(rows)
+
+
+# ======================== Export ========================
+
+EXPORT_USAGE = (
+    "<b>📦 Выгрузка обращений</b>\n\n"
+    "<code>/export [csv|jsonl] [open|answered] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]</code>\n\n"
+    "По умолчанию — CSV, все статусы, за всё время. Вместо «с» и «по» можно "
+    "писать from и to, любую из границ можно опустить. "
+    "Даты — по созданию обращения (UTC), обе включительно."
+)
+EXPORT_SINCE_WORDS = ("с", "from")
+EXPORT_UNTIL_WORDS = ("по", "to")
+
+
+def parse_export_args(args: str):
+    """(формат, статус, since, until) из аргументов /export; ValueError при ошибке"""
+    fmt, status, since, until = "csv", None, None, None
+    tokens = iter(args.lower().split())
+    for token in tokens:
+        if token in EXPORT_FORMATS:
+            fmt = token
+        elif token in ("open", "answered"):
+            status = token
+        elif token in EXPORT_SINCE_WORDS:
+            since = datetime.strptime(next(tokens, ""), "%Y-%m-%d")
+        elif token in EXPORT_UNTIL_WORDS:
+            # Верхняя граница включительно: до начала следующего дня
+            until = datetime.strptime(next(tokens, ""), "%Y-%m-%d") + timedelta(days=1)
+        else:
+            raise ValueError(f"Unexpected /export argument {token!r}")
+    return (
+        fmt, status,
+        since.strftime("%Y-%m-%d %H:%M:%S") if since else None,
+        until.strftime("%Y-%m-%d %H:%M:%S") if until else None,
+    )
+
+
 # ======================== Cleanup ========================
 
-async def cleanup_old_reports():
-    """Удаляет отвеченные репорты старше 1 дня"""
-    threshold = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+CLEANUP_BATCH_SIZE = 200
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT id, notify_msg_ids FROM reports "
-            "WHERE status = 'answered' AND replied_at <= ?",
-            (threshold,)
-        )
-        old_reports = await cursor.fetchall()
-
-        for report in old_reports:
-            rid, notify_msg_ids = report
-            if notify_msg_ids:
-                for item in notify_msg_ids.split(","):
-                    if ":" in item:
-                        try:
-                            chat_id, msg_id = item.split(":")
-                            await bot.delete_message(int(chat_id), int(msg_id))
-                        except Exception:
-                            pass
-            logger.info(f"Cleanup: removing answered report #{rid}")
+last_cleanup_stats: Dict[str, Any] = {}
 
-        await db.execute(
-            "DELETE FROM reports WHERE status = 'answered' AND replied_at <= ?",
-            (threshold,)
-        )
-        await db.commit()
+
+async def cleanup_old_reports():
+    """Переносит отвеченные репорты старше 1 дня в архив"""
+    global last_cleanup_stats
+    threshold = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    started = time.monotonic()
+    archived = messages = batches = 0
+
+    # Короткими пачками: лок записи отпускается между ними, а сами удаления
+    # сообщений уходят в outbox и выполняются воркером с лимитами Telegram.
+    while True:
+        async with db.transaction() as conn:
+            async with conn.execute(
+                "SELECT id, user_id FROM reports WHERE status = 'answered' AND replied_at <= ? "
+                "ORDER BY replied_at LIMIT ?",
+                (threshold, CLEANUP_BATCH_SIZE)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                break
+            ids = [row[0] for row in rows]
+            await report_archive.move(conn, ids)
+
+            placeholders = ",".join("?" * len(ids))
+            messages += await Outbox.enqueue_from_query(
+                conn, "delete",
+                "SELECT chat_id, message_id FROM report_notifications "
+                f"WHERE report_id IN ({placeholders})",
+                ids
+            )
+            await conn.execute(
+                f"DELETE FROM report_notifications WHERE report_id IN ({placeholders})", ids
+            )
+            await conn.execute(
+                f"DELETE FROM outbox WHERE kind = 'send' AND report_id IN ({placeholders})", ids
+            )
+            await conn.execute(f"DELETE FROM reports WHERE id IN ({placeholders})", ids)
+        invalidate_views(ids, [row[1] for row in rows])
+        archived += len(ids)
+        batches += 1
+        outbox.wake()
+        await asyncio.sleep(0)
+
+    last_cleanup_stats = {
+        "reports": archived,
+        "messages": messages,
+        "batches": batches,
+        "duration": round(time.monotonic() - started, 3),
+        "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if archived:
+        logger.info(f"Cleanup: {last_cleanup_stats}")
+    return last_cleanup_stats
 
 
 # ======================== Main ========================
 
 async def on_startup():
+    await db.connect()
     await init_db()
+    await staff_roster.load(db)
+    await chat_registry.load()
+    staff_roster.backfill(chat_registry.user_id)
+    await load_balancer.load(db)
+    await sla_stats.load(db)
     await bot.set_my_commands([
         BotCommand(command="start", description="🏠 Главное меню"),
         BotCommand(command="panel", description="🔧 Панель поддержки (для персонала)"),
+        BotCommand(command="search", description="🔎 Поиск по обращениям (для персонала)"),
     ])
     scheduler.add_job(cleanup_old_reports, "interval", hours=1)
+    scheduler.add_job(storage.sweep, "interval", minutes=30)
+    scheduler.add_job(reconcile_report_counters, "interval", hours=6)
+    scheduler.add_job(escalate_stale_assignments, "interval", minutes=1)
+    scheduler.add_job(chat_registry.flush, "interval", seconds=CHAT_REGISTRY_FLUSH_SECONDS)
+    scheduler.add_job(staff_roster.flush, "interval", seconds=CHAT_REGISTRY_FLUSH_SECONDS, args=[db])
+    scheduler.add_job(sla_stats.flush, "interval", seconds=CHAT_REGISTRY_FLUSH_SECONDS, args=[db])
     scheduler.start()
+    outbox.start()
+    update_pool.start()
+
+    global metrics_runner
+    metrics.gauge("updates", update_pool.stats)
+    metrics.gauge("db_writer", db.stats)
+    metrics.gauge("assignment", load_balancer.stats)
+    metrics.gauge("sla", sla_stats.stats)
+    metrics.gauge("staff_roster", staff_roster.stats)
+    metrics.gauge("fsm_cache", storage.stats)
+    metrics.gauge("throttling", throttling.stats)
+    metrics.gauge("callbacks", callback_router.stats)
+    metrics.gauge("report_view_cache", report_view_cache.stats)
+    metrics.gauge("cleanup", lambda: last_cleanup_stats)
+    if METRICS_PORT:
+        try:
+            metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            # Занятый порт не должен мешать запуску бота
+            logger.error(f"Metrics endpoint disabled, cannot bind {METRICS_HOST}:{METRICS_PORT}: {e}")
     logger.info("Bot started!")
     logger.info(f"Admins: {ADMINS}")
     logger.info(f"Server: {SERVER_IP}")
 
 
+async def on_shutdown():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    await update_pool.stop()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await outbox.stop()
+    await storage.close()
+    await chat_registry.flush()
+    await staff_roster.flush(db)
+    await sla_stats.flush(db)
+    await db.close()
+    logger.info(f"Staff roster stats: {staff_roster.stats()}")
+    logger.info("Bot stopped")
+
+
+async def run_webhook():
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+
+    app = web.Application()
+    # Запрос только ставит апдейт в update_pool, поэтому Telegram сразу получает 200,
+    # а обработка идёт в воркерах; при переполнении пула ответ придерживается
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=False,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Webhook listening on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+
+    # В отличие от start_polling, здесь SIGTERM/SIGINT никто не ловит: без
+    # обработчика процесс умрёт, не разобрав update_pool и не вызвав on_shutdown
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = (signal.SIGTERM, signal.SIGINT)
+    for sig in signals:
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+        logger.info("Stop signal received, shutting down webhook server")
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        # Сначала перестаём принимать запросы, затем main() вызовет on_shutdown
+        await runner.cleanup()
+
+
 async def main():
     await on_startup()
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await bot.delete_webhook()
+            # Апдейт лишь ставится в update_pool, отдельные задачи на каждый не нужны
+            await dp.start_polling(bot, handle_as_tasks=False)
+    finally:
+        await on_shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, Literal, Optional, Tuple, Type
+
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+from pydantic import Field
+from typing_extensions import Annotated
+
+logger = logging.getLogger(__name__)
+
+STALE_TEXT = "⚠️ Кнопка устарела. Откройте меню заново: /start"
+
+# Курсоры пагинации: направление и момент ответа в виде 20240501123000
+Direction = Literal["p", "n"]
+Timestamp = Annotated[str, Field(pattern=r"^\d{14}$")]
+
+
+# ======================== Фабрики callback_data ========================
+# Префиксы короткие и ни один не является началом другого: по ним же
+# матчатся лимиты ThrottlingMiddleware.
+
+class BackToMenu(CallbackData, prefix="menu"):
+    pass
+
+
+class Connect(CallbackData, prefix="conn"):
+    pass
+
+
+class Support(CallbackData, prefix="supp"):
+    pass
+
+
+class CreateReport(CallbackData, prefix="new"):
+    pass
+
+
+class MyReports(CallbackData, prefix="mine"):
+    pass
+
+
+class StaffOpenReports(CallbackData, prefix="open"):
+    pass
+
+
+class OpenPage(CallbackData, prefix="opg"):
+    direction: Direction
+    report_id: int
+
+
+class StaffAnsweredReports(CallbackData, prefix="done"):
+    pass
+
+
+class AnsweredPage(CallbackData, prefix="dpg"):
+    direction: Direction
+    ts: Timestamp
+    report_id: int
+
+
+class BackToPanel(CallbackData, prefix="panel"):
+    pass
+
+
+class ViewReport(CallbackData, prefix="view"):
+    report_id: int
+
+
+class ReplyReport(CallbackData, prefix="reply"):
+    report_id: int
+
+
+class SearchPage(CallbackData, prefix="spg"):
+    page: int
+
+
+class ManageHelpers(CallbackData, prefix="staff"):
+    pass
+
+
+class AddHelper(CallbackData, prefix="hadd"):
+    pass
+
+
+class RemoveHelper(CallbackData, prefix="hdel"):
+    username: str
+
+
+# Кнопки в уже отправленных сообщениях (меню в истории чата, уведомления
+# персоналу и задания outbox) несут старый формат — принимаем и его
+LEGACY_EXACT: Dict[str, CallbackData] = {
+    "back_to_menu": BackToMenu(),
+    "connect": Connect(),
+    "support": Support(),
+    "create_report": CreateReport(),
+    "my_reports": MyReports(),
+    "staff_open_reports": StaffOpenReports(),
+    "staff_answered_reports": StaffAnsweredReports(),
+    "back_to_panel": BackToPanel(),
+    "manage_helpers": ManageHelpers(),
+    "add_helper": AddHelper(),
+}
+# префикс -> (фабрика, поле), значение поля — остаток строки
+LEGACY_PREFIXES: Dict[str, Tuple[Type[CallbackData], str]] = {
+    "view_report_": (ViewReport, "report_id"),
+    "reply_report_": (ReplyReport, "report_id"),
+    "remove_helper_": (RemoveHelper, "username"),
+}
+
+
+class CallbackRouter:
+    """Таблица действий: префикс callback_data -> (фабрика, хендлер).
+
+    Регистрируется в aiogram одним хендлером callback_query; dispatch()
+    находит действие одним поиском по словарю, разбирает и валидирует
+    данные фабрикой и только потом вызывает хендлер с callback_data.
+    Неизвестные и битые данные отклоняются ответом на callback, не доходя
+    до хендлеров и базы.
+    """
+
+    def __init__(self, separator: str = ":"):
+        self.separator = separator
+        self._routes: Dict[str, Tuple[Type[CallbackData], CallableObject]] = {}
+        self.rejected = 0
+
+    def route(self, factory: Type[CallbackData]) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+        def decorator(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            prefix = factory.__prefix__
+            if prefix in self._routes:
+                raise ValueError(f"Callback prefix {prefix!r} is already routed")
+            self._routes[prefix] = (factory, CallableObject(handler))
+            return handler
+        return decorator
+
+    def parse(self, data: str) -> Optional[Tuple[CallbackData, CallableObject]]:
+        route = self._routes.get(data.split(self.separator, 1)[0])
+        if route is None:
+            return self._parse_legacy(data)
+        factory, handler = route
+        try:
+            return factory.unpack(data), handler
+        except (TypeError, ValueError):
+            # pydantic.ValidationError — подкласс ValueError
+            return None
+
+    def _parse_legacy(self, data: str) -> Optional[Tuple[CallbackData, CallableObject]]:
+        callback_data = LEGACY_EXACT.get(data)
+        if callback_data is None:
+            for prefix, (factory, field) in LEGACY_PREFIXES.items():
+                if data.startswith(prefix):
+                    try:
+                        callback_data = factory(**{field: data[len(prefix):]})
+                    except ValueError:
+                        return None
+                    break
+            else:
+                return None
+        route = self._routes.get(callback_data.__prefix__)
+        return (callback_data, route[1]) if route else None
+
+    def handler_name(self, callback: CallbackQuery) -> Optional[str]:
+        """Имя хендлера действия — для метрик"""
+        data = callback.data or ""
+        route = self._routes.get(data.split(self.separator, 1)[0])
+        if route is None:
+            parsed = self._parse_legacy(data)
+            return parsed[1].callback.__name__ if parsed else None
+        return route[1].callback.__name__
+
+    async def dispatch(self, callback: CallbackQuery, **data: Any) -> Any:
+        parsed = self.parse(callback.data or "")
+        if parsed is None:
+            self.rejected += 1
+            logger.debug(f"Rejected callback data {callback.data!r}")
+            await callback.answer(STALE_TEXT, show_alert=True)
+            return None
+        callback_data, handler = parsed
+        return await handler.call(callback, callback_data=callback_data, **data)
+
+    def stats(self) -> Dict[str, int]:
+        return {"routes": len(self._routes), "rejected": self.rejected}
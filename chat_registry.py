@@ -0,0 +1,105 @@
+import logging
+from typing import Dict, Optional, Set, Tuple
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRegistry:
+    """Соответствие username → chat_id с отложенной записью в SQLite.
+
+    Middleware пишет только в память; изменённые записи копятся в _dirty
+    и сбрасываются в базу одним батчем из периодической задачи flush().
+    При старте реестр прогревается из таблицы chat_ids, поэтому после
+    перезапуска уведомления персоналу доходят сразу.
+
+    На каждый user_id хранится только текущий username: когда пользователь
+    появляется под новым именем (или без имени), старая запись удаляется.
+    Иначе user_id(old) вернул бы прежнего владельца username, и привязка
+    персонала по нему досталась бы не тому аккаунту.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._chats: Dict[str, Tuple[int, int]] = {}
+        # user_id -> текущий username
+        self._names: Dict[int, str] = {}
+        self._dirty: Dict[str, Tuple[int, int]] = {}
+        # (username, user_id) устаревших записей для удаления из chat_ids
+        self._stale: Set[Tuple[str, int]] = set()
+
+    async def load(self):
+        rows = await self.db.fetchall(
+            "SELECT username, user_id, chat_id FROM chat_ids ORDER BY updated_at, rowid"
+        )
+        self._chats, self._names = {}, {}
+        for uname, user_id, chat_id in rows:
+            self._forget_user(user_id)
+            self._chats[uname] = (user_id, chat_id)
+            self._names[user_id] = uname
+        if self._stale:
+            logger.info(f"Chat registry: {len(self._stale)} outdated usernames to drop")
+        logger.info(f"Chat registry loaded: {len(self._chats)} chats")
+
+    def record(self, username: Optional[str], user_id: int, chat_id: int):
+        uname = username.lower() if username else None
+        if uname is not None and self._chats.get(uname) == (user_id, chat_id):
+            return
+        if self._names.get(user_id) != uname:
+            self._forget_user(user_id)
+        if uname is None:
+            return
+        previous = self._chats.get(uname)
+        if previous is not None and previous[0] != user_id:
+            # Username перешёл к другому аккаунту
+            self._names.pop(previous[0], None)
+        entry = (user_id, chat_id)
+        self._chats[uname] = entry
+        self._names[user_id] = uname
+        self._dirty[uname] = entry
+        self._stale.discard((uname, user_id))
+
+    def _forget_user(self, user_id: int):
+        old = self._names.pop(user_id, None)
+        if old is not None and self._chats.get(old, (None,))[0] == user_id:
+            del self._chats[old]
+            self._dirty.pop(old, None)
+            self._stale.add((old, user_id))
+
+    def user_id(self, username: str) -> Optional[int]:
+        """user_id, для которого username — последний известный"""
+        entry = self._chats.get(username.lower())
+        return entry[0] if entry else None
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    async def flush(self):
+        if not self._dirty and not self._stale:
+            return
+        batch, self._dirty = self._dirty, {}
+        stale, self._stale = self._stale, set()
+        try:
+            async with self.db.transaction() as conn:
+                # Удаляем только если имя всё ещё у того же user_id
+                await conn.executemany(
+                    "DELETE FROM chat_ids WHERE username = ? AND user_id = ?", stale
+                )
+                await conn.executemany(
+                    "INSERT INTO chat_ids (username, user_id, chat_id, updated_at) "
+                    "VALUES (?, ?, ?, CURRENT_TIMESTAMP) "
+                    "ON CONFLICT(username) DO UPDATE SET "
+                    "user_id = excluded.user_id, chat_id = excluded.chat_id, "
+                    "updated_at = excluded.updated_at",
+                    [(uname, user_id, chat_id) for uname, (user_id, chat_id) in batch.items()]
+                )
+        except Exception as e:
+            # Возвращаем несохранённое, не затирая более свежие изменения
+            for uname, entry in batch.items():
+                if self._chats.get(uname) == entry:
+                    self._dirty.setdefault(uname, entry)
+            self._stale |= {
+                (uname, user_id) for uname, user_id in stale if self._names.get(user_id) != uname
+            }
+            logger.error(f"Chat registry flush failed: {e}")
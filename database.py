@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Размер кэша подготовленных выражений sqlite3 на одно соединение
+STATEMENT_CACHE_SIZE = 256
+# Отрицательное значение — размер кэша страниц в КиБ (≈16 МиБ)
+PAGE_CACHE_KIB = 16384
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA cache_size = -{PAGE_CACHE_KIB}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Групповой коммит: записи, пришедшие за окно, идут одной транзакцией
+GROUP_COMMIT_WINDOW = 0.002
+GROUP_COMMIT_MAX_BATCH = 256
+
+Work = Callable[[aiosqlite.Connection], Awaitable[Any]]
+WriteJob = Tuple[Work, "asyncio.Future[Any]"]
+
+
+class Database:
+    """Постоянные соединения с SQLite: одно на запись, одно на чтение.
+
+    Соединения открываются один раз в on_startup и живут до остановки бота.
+    Все записи сериализуются через asyncio.Lock, чтобы транзакции разных
+    хендлеров не перемешивались на общем соединении. Чтение идёт через
+    отдельное соединение и в режиме WAL не блокируется писателем.
+
+    Короткие записи (execute и write) идут через задачу группового коммита:
+    всё, что накопилось в очереди за commit_window, выполняется одной
+    транзакцией. Если одна запись падает, транзакция откатывается и группа
+    выполняется заново без неё, так что ошибка не задевает соседей.
+    Вызывающий получает результат только после COMMIT.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        commit_window: float = GROUP_COMMIT_WINDOW,
+        max_batch: int = GROUP_COMMIT_MAX_BATCH,
+    ):
+        self.path = path
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._reader: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._queue: "asyncio.Queue[Optional[WriteJob]]" = asyncio.Queue()
+        self._commit_task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.batches = 0
+        self.largest_batch = 0
+        # observe(operation, seconds, error) — хук для метрик, вызывается на каждый запрос
+        self.observe: Optional[Callable[[str, float, bool], None]] = None
+
+    async def _open(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(
+            self.path,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def connect(self):
+        if self._writer is not None:
+            return
+        self._writer = await self._open()
+        self._reader = await self._open()
+        self._commit_task = asyncio.create_task(self._commit_loop())
+        logger.info(f"Database connected: {self.path}")
+
+    async def close(self):
+        if self._commit_task is not None:
+            # Дописываем уже поставленное в очередь и останавливаем задачу
+            self._queue.put_nowait(None)
+            await self._commit_task
+            self._commit_task = None
+        async with self._write_lock:
+            for conn in (self._reader, self._writer):
+                if conn is not None:
+                    await conn.close()
+            self._reader = None
+            self._writer = None
+        logger.info("Database closed")
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def _record(self, operation: str, started: float, error: bool):
+        if self.observe is not None:
+            self.observe(operation, time.perf_counter() - started, error)
+
+    # ---------- Чтение ----------
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        started, error = time.perf_counter(), True
+        try:
+            async with self._reader.execute(sql, params) as cursor:
+                row = await cursor.fetchone()
+            error = False
+            return row
+        finally:
+            self._record("fetchone", started, error)
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> list:
+        started, error = time.perf_counter(), True
+        try:
+            async with self._reader.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+            error = False
+            return rows
+        finally:
+            self._record("fetchall", started, error)
+
+    async def fetchval(self, sql: str, params: Sequence[Any] = ()) -> Any:
+        row = await self.fetchone(sql, params)
+        return row[0] if row else None
+
+    @asynccontextmanager
+    async def snapshot(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Отдельное соединение для долгого чтения с одним снимком базы на весь блок.
+
+        Для выгрузок: курсор читается кусками и не занимает общее соединение
+        чтения, а запись в режиме WAL идёт параллельно и в снимок не попадает.
+        """
+        conn = await self._open()
+        try:
+            await conn.execute("BEGIN")
+            yield conn
+        finally:
+            # Закрытие откатывает читающую транзакцию
+            await conn.close()
+
+    # ---------- Запись ----------
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> aiosqlite.Cursor:
+        """Одиночная запись через групповой коммит. Возвращает курсор (lastrowid, rowcount)."""
+        started, error = time.perf_counter(), True
+        try:
+            cursor = await self.write(lambda conn: conn.execute(sql, params))
+            error = False
+            return cursor
+        finally:
+            self._record("execute", started, error)
+
+    async def write(self, work: Work) -> Any:
+        """Выполняет work(conn) в общей транзакции группы и возвращает его результат.
+
+        work должен писать только через переданное соединение (вызов
+        db.execute или db.transaction изнутри приведёт к взаимоблокировке)
+        и не иметь других побочных эффектов: при ошибке соседней записи
+        группа выполняется повторно.
+        """
+        if self._commit_task is None:
+            async with self.transaction() as conn:
+                return await work(conn)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((work, future))
+        return await future
+
+    async def executemany(self, sql: str, seq: Iterable[Sequence[Any]]) -> aiosqlite.Cursor:
+        async with self.transaction() as conn:
+            return await conn.executemany(sql, seq)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """BEGIN IMMEDIATE ... COMMIT на соединении записи; ROLLBACK при ошибке."""
+        started, error = time.perf_counter(), True
+        try:
+            async with self._write_lock:
+                await self._writer.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self._writer
+                except BaseException:
+                    await self._writer.execute("ROLLBACK")
+                    raise
+                else:
+                    await self._writer.execute("COMMIT")
+            error = False
+        finally:
+            self._record("transaction", started, error)
+
+    # ---------- Групповой коммит ----------
+
+    async def _commit_loop(self):
+        stopping = False
+        while not stopping:
+            job = await self._queue.get()
+            if job is None:
+                break
+            batch: List[WriteJob] = [job]
+            if self.commit_window:
+                await asyncio.sleep(self.commit_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: List[WriteJob]):
+        results: Dict[int, Any] = {}
+        failed: Dict[int, Exception] = {}
+        started, error = time.perf_counter(), True
+        try:
+            async with self._write_lock:
+                while True:
+                    await self._writer.execute("BEGIN IMMEDIATE")
+                    try:
+                        results = await self._run_batch(batch, failed)
+                        if results is not None:
+                            await self._writer.execute("COMMIT")
+                            break
+                    except BaseException:
+                        await self._writer.execute("ROLLBACK")
+                        raise
+                    # Упавшая запись исключена, остальные выполняются заново
+                    await self._writer.execute("ROLLBACK")
+            error = False
+        except Exception as e:
+            # Транзакция откачена целиком: ошибку получают все оставшиеся записи
+            failed.update((i, e) for i in range(len(batch)) if i not in failed)
+        finally:
+            self._record("group_commit", started, error)
+
+        self.writes += len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in failed:
+                future.set_exception(failed[i])
+            else:
+                future.set_result(results[i])
+
+    async def _run_batch(self, batch: List[WriteJob], failed: Dict[int, Exception]) -> Optional[Dict[int, Any]]:
+        """Выполняет записи группы; None — если одна упала (она добавлена в failed)"""
+        results = {}
+        for i, (work, _) in enumerate(batch):
+            if i in failed:
+                continue
+            try:
+                results[i] = await work(self._writer)
+            except Exception as e:
+                failed[i] = e
+                return None
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "writes": self.writes,
+            "batches": self.batches,
+            "avg_batch": round(self.writes / self.batches, 2) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "queued": self._queue.qsize(),
+        }
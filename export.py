@@ -0,0 +1,113 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from typing import IO, Any, Iterable, List, Optional, Sequence
+
+import aiosqlite
+
+from archive import PACKED_FIELDS, unpack
+from database import Database
+
+# Строк за один fetchmany: память выгрузки не зависит от размера таблицы
+EXPORT_CHUNK_SIZE = 500
+
+FORMATS = ("csv", "jsonl")
+
+# Порядок колонок совпадает с карточкой обращения и ReportArchive.get()
+COLUMNS = (
+    "id", "user_id", "username", "first_name", "message", "status",
+    "reply", "replied_by", "created_at", "replied_at",
+)
+
+
+def _encode(fmt: str, rows: Iterable[Sequence[Any]]) -> str:
+    if fmt == "jsonl":
+        return "".join(
+            json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows
+        )
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _unpack_archived(rows: Iterable[Sequence[Any]]) -> List[tuple]:
+    result = []
+    for rid, user_id, created_at, replied_at, data in rows:
+        fields = dict(zip(PACKED_FIELDS, unpack(data)))
+        result.append((
+            rid, user_id, fields["username"], fields["first_name"], fields["message"],
+            "archived", fields["reply"], fields["replied_by"], created_at, replied_at,
+        ))
+    return result
+
+
+def _write_chunk(out: IO[str], fmt: str, rows: Sequence[Sequence[Any]], archived: bool):
+    out.write(_encode(fmt, _unpack_archived(rows) if archived else rows))
+
+
+async def _copy(
+    conn: aiosqlite.Connection, out: IO[str], fmt: str,
+    sql: str, params: Sequence[Any], archived: bool = False,
+) -> int:
+    count = 0
+    async with conn.execute(sql, params) as cursor:
+        while True:
+            rows = await cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                return count
+            # Распаковка, кодирование и gzip — в потоке, event loop свободен
+            await asyncio.to_thread(_write_chunk, out, fmt, rows, archived)
+            count += len(rows)
+
+
+async def export_reports(
+    db: Database,
+    path: str,
+    fmt: str = "csv",
+    status: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> int:
+    """Пишет обращения в path (gzip, CSV или JSONL) и возвращает число строк.
+
+    status — 'open' или 'answered' (отвеченные включают архив), None — все.
+    since / until — границы created_at (UTC) в формате 'YYYY-MM-DD HH:MM:SS',
+    since включительно, until — нет. Обе выборки читаются из одного снимка,
+    так что уборка, переносящая обращения в архив, не даёт дублей и пропусков.
+    """
+    conditions, params = [], []
+    if since:
+        conditions.append("created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("created_at < ?")
+        params.append(until)
+    archive_where = " AND ".join(conditions) or "1"
+    reports_params = list(params)
+    if status:
+        conditions.append("status = ?")
+        reports_params.append(status)
+    reports_where = " AND ".join(conditions) or "1"
+
+    out = await asyncio.to_thread(gzip.open, path, "wt", encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            await asyncio.to_thread(out.write, _encode(fmt, [COLUMNS]))
+        async with db.snapshot() as conn:
+            count = await _copy(
+                conn, out, fmt,
+                f"SELECT {', '.join(COLUMNS)} FROM reports WHERE {reports_where} ORDER BY id",
+                reports_params
+            )
+            if status != "open":
+                count += await _copy(
+                    conn, out, fmt,
+                    "SELECT id, user_id, created_at, replied_at, data FROM reports_archive "
+                    f"WHERE {archive_where} ORDER BY id",
+                    params, archived=True
+                )
+    finally:
+        await asyncio.to_thread(out.close)
+    return count
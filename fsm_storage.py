@@ -0,0 +1,107 @@
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from cache import LRUCache
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей держать в памяти и через сколько секунд состояние считается брошенным
+CACHE_SIZE = 10000
+STATE_TTL = 24 * 60 * 60
+
+# (state, data, updated_at)
+Record = Tuple[Optional[str], Dict[str, Any], float]
+_EMPTY: Record = (None, {}, 0.0)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_states с LRU-кэшем в памяти.
+
+    Запись идёт сразу в базу (write-through), поэтому незавершённые диалоги
+    переживают перезапуск. В кэше держатся и пустые записи: aiogram читает
+    состояние на каждый апдейт, и пользователи без состояния не должны
+    ходить в базу. Память ограничена размером кэша, а брошенные состояния
+    старше ttl удаляет sweep() из планировщика.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        cache_size: int = CACHE_SIZE,
+        ttl: float = STATE_TTL,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._cache = LRUCache(cache_size)
+
+    async def _load(self, key: str) -> Record:
+        record = self._cache.get(key)
+        if record is None:
+            row = await self.db.fetchone(
+                "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+            )
+            record = (row[0], json.loads(row[1]), row[2]) if row else _EMPTY
+            self._cache.set(key, record)
+        if record[2] and time.time() - record[2] > self.ttl:
+            return _EMPTY
+        return record
+
+    async def _store(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        if state is None and not data:
+            if self._cache.get(key) is _EMPTY:
+                # Уже пусто и в базе строки нет: clear() на каждом переходе по меню
+                return
+            self._cache.set(key, _EMPTY)
+            await self.db.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+            return
+        now = time.time()
+        self._cache.set(key, (state, data, now))
+        await self.db.execute(
+            "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+            "data = excluded.data, updated_at = excluded.updated_at",
+            (key, state, json.dumps(data, ensure_ascii=False), now)
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey = self.key_builder.build(key)
+        _, data, _ = await self._load(skey)
+        await self._store(skey, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        skey = self.key_builder.build(key)
+        state, _, _ = await self._load(skey)
+        await self._store(skey, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._load(self.key_builder.build(key))
+        return data.copy()
+
+    async def sweep(self) -> int:
+        """Удаляет состояния, не менявшиеся дольше ttl"""
+        deadline = time.time() - self.ttl
+        cursor = await self.db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (deadline,))
+        for key, record in self._cache.items():
+            if record[2] and record[2] < deadline:
+                self._cache.pop(key)
+        if cursor.rowcount:
+            logger.info(f"FSM sweep: removed {cursor.rowcount} stale states")
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+    async def close(self) -> None:
+        self._cache.clear()
@@ -0,0 +1,197 @@
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах (как у Prometheus по умолчанию)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: наблюдение — один bisect."""
+
+    __slots__ = ("counts", "total", "sum", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """Реестр метрик: задержки хендлеров, запросов к базе и вызовов Bot API."""
+
+    def __init__(self):
+        self.families: Dict[str, Dict[str, Histogram]] = {
+            "handler": {},
+            "db": {},
+            "api": {},
+        }
+        self.gauges: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self.started = time.time()
+
+    def observe(self, family: str, name: str, seconds: float, error: bool = False):
+        hist = self.families[family].get(name)
+        if hist is None:
+            hist = self.families[family][name] = Histogram()
+        hist.observe(seconds, error)
+
+    def gauge(self, name: str, source: Callable[[], Dict[str, float]]):
+        """Регистрирует источник мгновенных значений (stats() компонентов)"""
+        self.gauges[name] = source
+
+    def snapshot(self, family: str) -> List[Tuple[str, Histogram]]:
+        return sorted(self.families[family].items(), key=lambda item: -item[1].sum)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for family, hists in self.families.items():
+            metric = f"dmarena_{family}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, hist in hists.items():
+                label = f'name="{name}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, hist.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {hist.total}')
+                lines.append(f"{metric}_sum{{{label}}} {hist.sum:.6f}")
+                lines.append(f"{metric}_count{{{label}}} {hist.total}")
+            lines.append(f"# TYPE dmarena_{family}_errors_total counter")
+            for name, hist in hists.items():
+                lines.append(f'dmarena_{family}_errors_total{{name="{name}"}} {hist.errors}')
+        for source_name, source in self.gauges.items():
+            for key, value in source().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"dmarena_{source_name}_{key} {value}")
+        lines.append(f"dmarena_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    # ---------- HTTP ----------
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render_prometheus(), content_type="text/plain")
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+        return runner
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время выполнения хендлера и ошибки, по имени функции-хендлера.
+
+    resolve — имя для событий, которые aiogram отдаёт общему хендлеру-
+    диспетчеру (callback_query): так метрики остаются по действиям.
+    """
+
+    def __init__(self, metrics: Metrics, resolve: Optional[Callable[[TelegramObject], Optional[str]]] = None):
+        self.metrics = metrics
+        self.resolve = resolve
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = self.resolve(event) if self.resolve else None
+        if name is None:
+            name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.metrics.observe("handler", name, time.perf_counter() - started, error)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время вызовов Bot API по методу (SendMessage, EditMessageText, ...)."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        error = False
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.metrics.observe("api", type(method).__name__, time.perf_counter() - started, error)
+
+
+def db_observer(metrics: Metrics) -> Callable[[str, float, bool], None]:
+    """Колбэк для Database.observe"""
+    def observe(operation: str, seconds: float, error: bool):
+        metrics.observe("db", operation, seconds, error)
+    return observe
+
+
+def format_stats(metrics: Metrics, limit: Optional[int] = 10) -> str:
+    """Текстовая сводка для команды /stats"""
+    titles = {"handler": "⚙️ Хендлеры", "db": "🗄 База", "api": "📡 Bot API"}
+    text = "<b>📈 Статистика</b>\n"
+    for family, title in titles.items():
+        rows = metrics.snapshot(family)[:limit]
+        text += f"\n<b>{title}</b>\n"
+        if not rows:
+            text += "<i>нет данных</i>\n"
+            continue
+        for name, hist in rows:
+            text += (
+                f"<code>{name}</code>: {hist.total} шт., "
+                f"p50 {hist.quantile(0.5) * 1000:.1f} мс, "
+                f"p95 {hist.quantile(0.95) * 1000:.1f} мс"
+            )
+            if hist.errors:
+                text += f", ошибок {hist.errors}"
+            text += "\n"
+    for source_name, source in metrics.gauges.items():
+        values = ", ".join(f"{k}={v}" for k, v in source().items())
+        text += f"\n<b>{source_name}</b>: {values}"
+    return text
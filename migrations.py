@@ -0,0 +1,308 @@
+import logging
+
+import aiosqlite
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция выполняется
+# в своей короткой транзакции вместе с повышением версии, поэтому её можно
+# применять к рабочей dmarena.db на месте: при сбое версия не меняется.
+# Миграции только добавляются в конец списка; уже выпущенные не правятся.
+
+
+async def _v1_base_schema(conn: aiosqlite.Connection):
+    """Базовые таблицы reports и helpers"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            message TEXT NOT NULL,
+            status TEXT DEFAULT 'open',
+            reply TEXT,
+            replied_by TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            replied_at TIMESTAMP,
+            notify_msg_ids TEXT DEFAULT ''
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS helpers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            added_by TEXT
+        )
+    """)
+
+
+async def _v2_chat_ids(conn: aiosqlite.Connection):
+    """Реестр username → chat_id"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_ids (
+            username TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+async def _v3_outbox_and_notifications(conn: aiosqlite.Connection):
+    """Очередь outbox и таблица report_notifications с переносом notify_msg_ids"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            payload TEXT NOT NULL DEFAULT '{}',
+            report_id INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_notifications (
+            report_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL
+        )
+    """)
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_report_notifications_report "
+        "ON report_notifications (report_id)"
+    )
+
+    async with conn.execute(
+        "SELECT id, notify_msg_ids FROM reports WHERE notify_msg_ids != ''"
+    ) as cursor:
+        rows = await cursor.fetchall()
+    notifications = []
+    for rid, notify_msg_ids in rows:
+        for item in notify_msg_ids.split(","):
+            if ":" in item:
+                chat_id, msg_id = item.split(":")
+                notifications.append((rid, int(chat_id), int(msg_id)))
+    if notifications:
+        await conn.executemany(
+            "INSERT INTO report_notifications (report_id, chat_id, message_id) VALUES (?, ?, ?)",
+            notifications
+        )
+    await conn.execute("UPDATE reports SET notify_msg_ids = '' WHERE notify_msg_ids != ''")
+
+
+async def _v4_report_indexes(conn: aiosqlite.Connection):
+    """Индексы под горячие запросы по reports"""
+    # Списки открытых обращений и счётчики по статусу
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reports_status_id ON reports (status, id)"
+    )
+    # «Мои обращения»: WHERE user_id = ? ORDER BY id DESC
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reports_user_id ON reports (user_id, id)"
+    )
+    # Отвеченные по replied_at и очистка старых
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reports_status_replied ON reports (status, replied_at)"
+    )
+
+
+async def _v5_report_counters(conn: aiosqlite.Connection):
+    """Счётчики обращений по статусам, поддерживаемые триггерами"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_counters (
+            status TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reports_count_insert
+        AFTER INSERT ON reports
+        BEGIN
+            INSERT INTO report_counters (status, count) VALUES (NEW.status, 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reports_count_delete
+        AFTER DELETE ON reports
+        BEGIN
+            UPDATE report_counters SET count = count - 1 WHERE status = OLD.status;
+        END
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reports_count_update
+        AFTER UPDATE OF status ON reports
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE report_counters SET count = count - 1 WHERE status = OLD.status;
+            INSERT INTO report_counters (status, count) VALUES (NEW.status, 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END
+    """)
+    await conn.execute("DELETE FROM report_counters")
+    await conn.execute(
+        "INSERT INTO report_counters (status, count) "
+        "SELECT status, COUNT(*) FROM reports GROUP BY status"
+    )
+
+
+async def _v6_fsm_states(conn: aiosqlite.Connection):
+    """Хранилище состояний FSM"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+    """)
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)"
+    )
+
+
+async def _v7_reports_fts(conn: aiosqlite.Connection):
+    """Полнотекстовый индекс FTS5 по тексту обращений и ответов"""
+    # external content: текст хранится только в reports, индекс синхронизируют триггеры
+    await conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+            message, reply,
+            content = 'reports', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reports_fts_insert
+        AFTER INSERT ON reports
+        BEGIN
+            INSERT INTO reports_fts (rowid, message, reply) VALUES (NEW.id, NEW.message, NEW.reply);
+        END
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reports_fts_delete
+        AFTER DELETE ON reports
+        BEGIN
+            INSERT INTO reports_fts (reports_fts, rowid, message, reply)
+            VALUES ('delete', OLD.id, OLD.message, OLD.reply);
+        END
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_reports_fts_update
+        AFTER UPDATE OF message, reply ON reports
+        BEGIN
+            INSERT INTO reports_fts (reports_fts, rowid, message, reply)
+            VALUES ('delete', OLD.id, OLD.message, OLD.reply);
+            INSERT INTO reports_fts (rowid, message, reply) VALUES (NEW.id, NEW.message, NEW.reply);
+        END
+    """)
+    await conn.execute("INSERT INTO reports_fts (reports_fts) VALUES ('rebuild')")
+
+
+async def _v8_reports_archive(conn: aiosqlite.Connection):
+    """Архив отвеченных обращений со сжатыми текстовыми полями и его поисковый индекс"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS reports_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            replied_at TIMESTAMP,
+            data BLOB NOT NULL
+        )
+    """)
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reports_archive_user_id ON reports_archive (user_id, id)"
+    )
+    # Архив сжат, поэтому для поиска нужен отдельный индекс без хранения текста
+    await conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS reports_archive_fts USING fts5(
+            message, reply,
+            content = '',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+
+
+async def _v9_report_assignment(conn: aiosqlite.Connection):
+    """Назначение обращений сотрудникам"""
+    await conn.execute("ALTER TABLE reports ADD COLUMN assigned_to TEXT")
+    await conn.execute("ALTER TABLE reports ADD COLUMN assigned_at REAL")
+    # Поиск просроченных назначений: status = 'open' AND assigned_at <= ?
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reports_status_assigned ON reports (status, assigned_at)"
+    )
+
+
+async def _v10_helpers_user_id(conn: aiosqlite.Connection):
+    """Привязка персонала к числовому user_id с переносом из chat_ids"""
+    await conn.execute("ALTER TABLE helpers ADD COLUMN user_id INTEGER")
+    # Только если username — последний известный у этого user_id: старые имена
+    # в chat_ids не вычищались, и по ним id мог указывать на прежнего владельца.
+    # При одинаковом updated_at однозначности нет — такие строки не привязываем.
+    await conn.execute("""
+        UPDATE helpers SET user_id = (
+            SELECT c.user_id FROM chat_ids c
+            WHERE c.username = helpers.username
+              AND NOT EXISTS (
+                  SELECT 1 FROM chat_ids o
+                  WHERE o.user_id = c.user_id AND o.username != c.username
+                    AND o.updated_at >= c.updated_at
+              )
+        )
+        WHERE user_id IS NULL
+    """)
+    await conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_helpers_user_id ON helpers (user_id) "
+        "WHERE user_id IS NOT NULL"
+    )
+
+
+async def _v11_sla_state(conn: aiosqlite.Connection):
+    """Сохранённое состояние статистики времени ответа"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS sla_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            data TEXT NOT NULL
+        )
+    """)
+
+
+MIGRATIONS = [
+    _v1_base_schema,
+    _v2_chat_ids,
+    _v3_outbox_and_notifications,
+    _v4_report_indexes,
+    _v5_report_counters,
+    _v6_fsm_states,
+    _v7_reports_fts,
+    _v8_reports_archive,
+    _v9_report_assignment,
+    _v10_helpers_user_id,
+    _v11_sla_state,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def run_migrations(db: Database) -> int:
+    """Применяет недостающие миграции и возвращает итоговую версию схемы"""
+    current = await db.fetchval("PRAGMA user_version")
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema v{current} is newer than supported v{SCHEMA_VERSION}"
+        )
+
+    for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        async with db.transaction() as conn:
+            await migration(conn)
+            await conn.execute(f"PRAGMA user_version = {version}")
+        logger.info(f"Migration v{version} applied: {migration.__doc__}")
+
+    if current < SCHEMA_VERSION:
+        # Свежая статистика для планировщика запросов после новых индексов
+        await db.execute("ANALYZE")
+    return SCHEMA_VERSION
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import aiosqlite
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+
+from database import Database
+from sender import Sender
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+POLL_INTERVAL = 5.0
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 600.0
+MAX_ATTEMPTS = 10
+
+
+class OutboxJob(NamedTuple):
+    id: int
+    kind: str
+    chat_id: int
+    message_id: Optional[int]
+    payload: str
+    report_id: Optional[int]
+    attempts: int
+
+
+class Outbox:
+    """Надёжная очередь исходящих вызовов Bot API (send / edit / delete).
+
+    Хендлеры кладут задания в таблицу outbox в той же транзакции, что и
+    изменение обращения, и сразу возвращаются. Фоновый воркер доставляет
+    задания через Sender, повторяет неудачные с экспоненциальной
+    задержкой и после перезапуска продолжает с незавершённых.
+
+    report_id заполняется только у уведомлений персонала: после отправки
+    on_sent(conn, job, result) сохраняет id сообщения для будущих правок —
+    в той же транзакции, что и удаление задания. Если пока отправка была
+    в полёте, задание сменило текст (ответ на обращение) или было удалено
+    (обращение ушло в архив), отправленное сообщение тут же правится или
+    удаляется следующим заданием.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        sender: Sender,
+        on_sent: Optional[Callable[[aiosqlite.Connection, OutboxJob, Any], Awaitable[None]]] = None,
+        batch_size: int = BATCH_SIZE,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.db = db
+        self.sender = sender
+        self.on_sent = on_sent
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- Постановка в очередь ----------
+
+    @staticmethod
+    async def enqueue(
+        conn: aiosqlite.Connection,
+        kind: str,
+        chat_id: int,
+        text: Optional[str] = None,
+        message_id: Optional[int] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        report_id: Optional[int] = None,
+    ):
+        """Добавляет задание в рамках транзакции вызывающего (db.transaction() или db.write())."""
+        await conn.execute(
+            "INSERT INTO outbox (kind, chat_id, message_id, payload, report_id, next_attempt_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, chat_id, message_id, _dump_payload(text, reply_markup), report_id, time.time())
+        )
+
+    @staticmethod
+    async def enqueue_from_query(
+        conn: aiosqlite.Connection,
+        kind: str,
+        query: str,
+        params: tuple = (),
+        text: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> int:
+        """Ставит одно задание на каждую строку (chat_id, message_id) из query одним INSERT."""
+        cursor = await conn.execute(
+            "INSERT INTO outbox (kind, chat_id, message_id, payload, next_attempt_at) "
+            f"SELECT ?, chat_id, message_id, ?, ? FROM ({query})",
+            (kind, _dump_payload(text, reply_markup), time.time(), *params)
+        )
+        return cursor.rowcount
+
+    @staticmethod
+    async def replace_pending(
+        conn: aiosqlite.Connection,
+        report_id: int,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ):
+        """Подменяет текст ещё не доставленных уведомлений персонала по обращению."""
+        await conn.execute(
+            "UPDATE outbox SET payload = ? WHERE kind = 'send' AND report_id = ?",
+            (_dump_payload(text, reply_markup), report_id)
+        )
+
+    def wake(self):
+        """Будит воркер; вызывать после коммита транзакции с enqueue()."""
+        self._wakeup.set()
+
+    async def pending(self) -> int:
+        return await self.db.fetchval("SELECT COUNT(*) FROM outbox")
+
+    # ---------- Воркер ----------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        tasks = [self._task, *self._inflight.values()]
+        # Незавершённые доставки останутся в таблице и будут повторены при старте
+        for task in self._inflight.values():
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._inflight.clear()
+
+    async def _run(self):
+        logger.info("Outbox worker started")
+        while True:
+            self._wakeup.clear()
+            free = self.batch_size - len(self._inflight)
+            jobs = await self._fetch_due(free) if free > 0 else []
+            for job in jobs:
+                task = asyncio.create_task(self._deliver(job))
+                self._inflight[job.id] = task
+                task.add_done_callback(lambda _, jid=job.id: self._done(jid))
+            if free <= 0 or len(jobs) < free:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _done(self, job_id: int):
+        self._inflight.pop(job_id, None)
+        self._wakeup.set()
+
+    async def _fetch_due(self, limit: int) -> List[OutboxJob]:
+        exclude = list(self._inflight)
+        placeholders = ",".join("?" * len(exclude))
+        rows = await self.db.fetchall(
+            "SELECT id, kind, chat_id, message_id, payload, report_id, attempts FROM outbox "
+            f"WHERE next_attempt_at <= ? {f'AND id NOT IN ({placeholders})' if exclude else ''} "
+            "ORDER BY next_attempt_at, id LIMIT ?",
+            (time.time(), *exclude, limit)
+        )
+        return [OutboxJob(*row) for row in rows]
+
+    async def _deliver(self, job: OutboxJob):
+        try:
+            result = await self._call(job)
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            # Постоянные ошибки (сообщение удалено, бот заблокирован): повтор не поможет
+            logger.warning(f"Outbox job #{job.id} ({job.kind}) dropped: {e}")
+            await self._settle(job, lambda conn: conn.execute("DELETE FROM outbox WHERE id = ?", (job.id,)))
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._reschedule(job, e)
+            return
+
+        # Вызов уже прошёл: повторяется только запись результата, не отправка
+        await self._settle(job, lambda conn: self._complete(conn, job, result))
+
+    async def _settle(self, job: OutboxJob, work: Callable[[aiosqlite.Connection], Awaitable[Any]]):
+        """Записывает итог доставки, при ошибке базы — повторяет с задержкой.
+
+        Пока идут повторы, задание остаётся в _inflight и не выбирается
+        заново, так что ни отправка, ни новая попытка не выполняются раньше
+        времени. При остановке бота задание останется в таблице как было.
+        """
+        delay = BACKOFF_BASE
+        while True:
+            try:
+                await self.db.write(work)
+                return
+            except Exception as e:
+                logger.error(f"Outbox job #{job.id} ({job.kind}) not settled, retry in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * BACKOFF_BASE, BACKOFF_MAX)
+
+    async def _complete(self, conn: aiosqlite.Connection, job: OutboxJob, result: Any):
+        if job.kind != "send" or job.report_id is None:
+            await conn.execute("DELETE FROM outbox WHERE id = ?", (job.id,))
+            return
+        async with conn.execute("SELECT payload FROM outbox WHERE id = ?", (job.id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            # Отменено во время отправки: обращения уже нет
+            await conn.execute(
+                "INSERT INTO outbox (kind, chat_id, message_id, payload, next_attempt_at) "
+                "VALUES ('delete', ?, ?, '{}', ?)",
+                (job.chat_id, result.message_id, time.time())
+            )
+            return
+        if row[0] != job.payload:
+            # Текст подменён replace_pending, пока уходил старый
+            await conn.execute(
+                "INSERT INTO outbox (kind, chat_id, message_id, payload, next_attempt_at) "
+                "VALUES ('edit', ?, ?, ?, ?)",
+                (job.chat_id, result.message_id, row[0], time.time())
+            )
+        await conn.execute("DELETE FROM outbox WHERE id = ?", (job.id,))
+        if self.on_sent:
+            await self.on_sent(conn, job, result)
+
+    async def _reschedule(self, job: OutboxJob, error: Exception):
+        attempts = job.attempts + 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.error(f"Outbox job #{job.id} ({job.kind}) gave up after {attempts} attempts: {error}")
+            await self._settle(job, lambda conn: conn.execute("DELETE FROM outbox WHERE id = ?", (job.id,)))
+            return
+        delay = min(BACKOFF_BASE ** attempts, BACKOFF_MAX)
+        logger.warning(f"Outbox job #{job.id} ({job.kind}) failed, retry in {delay:.0f}s: {error}")
+        await self._settle(job, lambda conn: conn.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE id = ?",
+            (attempts, time.time() + delay, job.id)
+        ))
+
+    def _call(self, job: OutboxJob) -> Awaitable[Any]:
+        payload = json.loads(job.payload)
+        markup = payload.get("reply_markup")
+        kwargs = {}
+        if markup is not None:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.model_validate(markup)
+        if job.kind == "send":
+            return self.sender.send_message(job.chat_id, payload["text"], **kwargs)
+        if job.kind == "edit":
+            return self.sender.edit_message_text(job.chat_id, job.message_id, payload["text"], **kwargs)
+        if job.kind == "delete":
+            return self.sender.delete_message(job.chat_id, job.message_id)
+        raise ValueError(f"Unknown outbox job kind: {job.kind}")
+
+
+def _dump_payload(text: Optional[str], reply_markup: Optional[InlineKeyboardMarkup]) -> str:
+    payload: Dict[str, Any] = {}
+    if text is not None:
+        payload["text"] = text
+    if reply_markup is not None:
+        payload["reply_markup"] = reply_markup.model_dump(exclude_none=True)
+    return json.dumps(payload, ensure_ascii=False)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: ~30 сообщений в секунду всего и ~1 в секунду на чат
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+PER_CHAT_BURST = 3
+MAX_CONCURRENCY = 10
+MAX_RETRY_AFTER_ATTEMPTS = 5
+# Бакеты чатов сверх этого числа вычищаются, если они полностью восстановились
+MAX_CHAT_BUCKETS = 1024
+
+
+class Sender:
+    """Параллельная отправка в Bot API с учётом лимитов Telegram.
+
+    Каждый вызов проходит через семафор (ограничение параллельности),
+    глобальный token bucket и бакет конкретного чата. TelegramRetryAfter
+    не теряет сообщение: чат ставится на паузу, вызов повторяется позже.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int = MAX_CONCURRENCY,
+        global_rate: float = GLOBAL_RATE,
+        per_chat_rate: float = PER_CHAT_RATE,
+        per_chat_burst: float = PER_CHAT_BURST,
+    ):
+        self.bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._global = TokenBucket(global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle}
+            bucket = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def call(self, chat_id: int, request: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет request() в рамках лимитов чата chat_id."""
+        bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                async with self._semaphore:
+                    return await request()
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > MAX_RETRY_AFTER_ATTEMPTS:
+                    raise
+                logger.warning(f"Flood limit for chat {chat_id}, retry in {e.retry_after}s")
+                bucket.pause(e.retry_after)
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> Awaitable[Any]:
+        return self.call(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs))
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs) -> Awaitable[Any]:
+        return self.call(chat_id, lambda: self.bot.edit_message_text(
+            text, chat_id=chat_id, message_id=message_id, **kwargs
+        ))
+
+    def delete_message(self, chat_id: int, message_id: int) -> Awaitable[Any]:
+        return self.call(chat_id, lambda: self.bot.delete_message(chat_id, message_id))
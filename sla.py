@@ -0,0 +1,326 @@
+import json
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from archive import unpack
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Относительная ошибка квантилей: p90 = 40 мин означает 40 мин ± 2%
+SKETCH_ACCURACY = 0.02
+# Ответы быстрее секунды идут в отдельную корзину, дольше года — в последнюю
+SKETCH_MIN = 1.0
+SKETCH_MAX = 365 * 24 * 3600.0
+
+# Скользящие окна: дни для квантилей «за неделю», часы для очереди
+WINDOW_DAYS = 7
+BACKLOG_HOURS = 24
+
+BACKFILL_BATCH = 1000
+
+
+class QuantileSketch:
+    """Потоковая оценка квантилей на логарифмических корзинах (как DDSketch).
+
+    Значение x попадает в корзину ceil(log_gamma(x)), поэтому любой квантиль
+    восстанавливается с относительной ошибкой не больше accuracy, а число
+    корзин ограничено диапазоном значений (сотни для секунд..года).
+    Скетчи складываются корзина к корзине, сериализуются в JSON.
+    """
+
+    __slots__ = ("accuracy", "gamma", "_log_gamma", "bins", "zeros", "count", "sum")
+
+    def __init__(self, accuracy: float = SKETCH_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        if value < SKETCH_MIN:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(min(value, SKETCH_MAX)) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def merge(self, other: "QuantileSketch"):
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return SKETCH_MAX
+
+    def to_dict(self) -> dict:
+        return {"a": self.accuracy, "z": self.zeros, "n": self.count, "s": self.sum, "b": self.bins}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuantileSketch":
+        sketch = cls(data["a"])
+        sketch.zeros = data["z"]
+        sketch.count = data["n"]
+        sketch.sum = data["s"]
+        # В JSON ключи словаря — строки
+        sketch.bins = {int(key): count for key, count in data["b"].items()}
+        return sketch
+
+
+def _epoch(utc_text: str) -> float:
+    """created_at пишется CURRENT_TIMESTAMP, то есть в UTC"""
+    return datetime.strptime(utc_text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _local_epoch(local_text: str) -> float:
+    """replied_at пишется datetime.now(), то есть в локальном времени сервера"""
+    return datetime.strptime(local_text, "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+class SlaStats:
+    """Статистика времени ответа поддержки, обновляемая по одному ответу.
+
+    process_reply передаёт сюда время ответа на каждое впервые отвеченное
+    обращение, process_report — факт создания. В памяти лежат скетч
+    квантилей за всё время, дневные скетчи за WINDOW_DAYS, счётчики и
+    суммы по сотрудникам и почасовые созданные/отвеченные за BACKLOG_HOURS,
+    поэтому /sla не сканирует reports и строится за постоянное время.
+
+    Состояние сохраняется JSON-ом в sla_state из периодического flush()
+    (ответы после последнего flush при аварийном падении теряются).
+    Если сохранённого состояния нет, load() один раз собирает его из
+    reports и reports_archive.
+    """
+
+    def __init__(self):
+        self.total = QuantileSketch()
+        self.days: Dict[int, QuantileSketch] = {}
+        # сотрудник (имя записи helpers) -> [ответов, сумма секунд]
+        self.helpers: Dict[str, List[float]] = {}
+        # час (epoch // 3600) -> [создано, отвечено]
+        self.hours: Dict[int, List[int]] = {}
+        self._dirty = False
+
+    # ---------- Учёт ----------
+
+    def record_created(self, at: Optional[float] = None):
+        self._hour(at)[0] += 1
+        self._dirty = True
+
+    def record_reply(self, created_ts: float, staff: str, at: Optional[float] = None):
+        at = time.time() if at is None else at
+        seconds = max(at - created_ts, 0.0)
+        self.total.add(seconds)
+        day = int(at // 86400)
+        sketch = self.days.get(day)
+        if sketch is None:
+            sketch = self.days[day] = QuantileSketch()
+            for old in [d for d in self.days if d <= day - WINDOW_DAYS]:
+                del self.days[old]
+        sketch.add(seconds)
+        helper = self.helpers.setdefault(staff.lower(), [0, 0.0])
+        helper[0] += 1
+        helper[1] += seconds
+        self._hour(at)[1] += 1
+        self._dirty = True
+
+    def _hour(self, at: Optional[float]) -> List[int]:
+        hour = int((time.time() if at is None else at) // 3600)
+        counts = self.hours.get(hour)
+        if counts is None:
+            counts = self.hours[hour] = [0, 0]
+            for old in [h for h in self.hours if h <= hour - BACKLOG_HOURS]:
+                del self.hours[old]
+        return counts
+
+    # ---------- Чтение ----------
+
+    def window(self) -> QuantileSketch:
+        """Скетч за последние WINDOW_DAYS (сумма дневных)"""
+        today = int(time.time() // 86400)
+        sketch = QuantileSketch()
+        for day, daily in self.days.items():
+            if day > today - WINDOW_DAYS:
+                sketch.merge(daily)
+        return sketch
+
+    def backlog(self, open_now: int, hours: int = BACKLOG_HOURS) -> List[Tuple[int, int, int, int]]:
+        """(час, создано, отвечено, открытых на конец часа), от нового к старому.
+
+        Очередь на конец часа восстанавливается назад от текущего числа
+        открытых вычитанием чистого прироста более поздних часов.
+        """
+        current = int(time.time() // 3600)
+        result = []
+        open_at_end = open_now
+        for hour in range(current, current - hours, -1):
+            created, answered = self.hours.get(hour, (0, 0))
+            result.append((hour, created, answered, max(open_at_end, 0)))
+            open_at_end -= created - answered
+        return result
+
+    def top_helpers(self, limit: int = 10) -> List[Tuple[str, int, float]]:
+        """(сотрудник, ответов, среднее время) по убыванию числа ответов"""
+        rows = sorted(self.helpers.items(), key=lambda item: -item[1][0])[:limit]
+        return [(name, int(count), total / count) for name, (count, total) in rows]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "answered": self.total.count,
+            "p50_seconds": round(self.total.quantile(0.5), 1),
+            "p90_seconds": round(self.total.quantile(0.9), 1),
+            "p99_seconds": round(self.total.quantile(0.99), 1),
+        }
+
+    # ---------- Хранение ----------
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total.to_dict(),
+            "days": {day: sketch.to_dict() for day, sketch in self.days.items()},
+            "helpers": self.helpers,
+            "hours": self.hours,
+        }
+
+    def _restore(self, data: dict):
+        self.total = QuantileSketch.from_dict(data["total"])
+        self.days = {int(day): QuantileSketch.from_dict(s) for day, s in data["days"].items()}
+        self.helpers = data["helpers"]
+        self.hours = {int(hour): counts for hour, counts in data["hours"].items()}
+
+    async def load(self, db: Database):
+        data = await db.fetchval("SELECT data FROM sla_state WHERE id = 1")
+        if data is not None:
+            self._restore(json.loads(data))
+            logger.info(f"SLA stats loaded: {self.total.count} replies")
+            return
+        await self._backfill(db)
+        await self.flush(db)
+
+    async def _backfill(self, db: Database):
+        """Первичное заполнение из истории, страницами по id"""
+        started = time.perf_counter()
+        last_id = 0
+        while True:
+            rows = await db.fetchall(
+                "SELECT id, created_at, replied_at, replied_by FROM reports "
+                "WHERE id > ? AND status = 'answered' AND replied_at IS NOT NULL "
+                "ORDER BY id LIMIT ?",
+                (last_id, BACKFILL_BATCH)
+            )
+            for _, created_at, replied_at, replied_by in rows:
+                self._backfill_one(created_at, replied_at, replied_by)
+            if len(rows) < BACKFILL_BATCH:
+                break
+            last_id = rows[-1][0]
+
+        last_id = 0
+        while True:
+            rows = await db.fetchall(
+                "SELECT id, created_at, replied_at, data FROM reports_archive "
+                "WHERE id > ? AND replied_at IS NOT NULL ORDER BY id LIMIT ?",
+                (last_id, BACKFILL_BATCH)
+            )
+            for _, created_at, replied_at, data in rows:
+                self._backfill_one(created_at, replied_at, unpack(data)[4])
+            if len(rows) < BACKFILL_BATCH:
+                break
+            last_id = rows[-1][0]
+
+        # Созданные за последние часы — для восстановления очереди
+        since = time.time() - BACKLOG_HOURS * 3600
+        rows = await db.fetchall(
+            "SELECT created_at FROM reports WHERE created_at >= ?",
+            (datetime.fromtimestamp(since, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),)
+        )
+        for (created_at,) in rows:
+            self.record_created(at=_epoch(created_at))
+        logger.info(
+            f"SLA stats backfilled: {self.total.count} replies "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    def _backfill_one(self, created_at: str, replied_at: str, replied_by: Optional[str]):
+        # В истории есть только username на момент ответа: для сотрудников,
+        # которые с тех пор не переименовывались, он совпадает с записью helpers
+        try:
+            created_ts = _epoch(created_at)
+            replied_ts = _local_epoch(replied_at)
+        except (TypeError, ValueError):
+            return
+        self.record_reply(created_ts, replied_by or "unknown", at=replied_ts)
+
+    async def flush(self, db: Database):
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await db.execute(
+                "INSERT INTO sla_state (id, data) VALUES (1, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                (json.dumps(self.to_dict(), separators=(",", ":")),)
+            )
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"SLA stats flush failed: {e}")
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин"
+    days, hours = divmod(hours, 24)
+    return f"{days} д {hours} ч"
+
+
+def format_sla(stats: SlaStats, open_now: int, backlog_hours: int = 12) -> str:
+    """Текстовая сводка для команды /sla"""
+    text = "<b>⏱ Время ответа поддержки</b>\n"
+    for title, sketch in ((f"За {WINDOW_DAYS} дней", stats.window()), ("За всё время", stats.total)):
+        text += f"\n<b>{title}</b> (ответов: {sketch.count})\n"
+        if not sketch.count:
+            text += "<i>нет данных</i>\n"
+            continue
+        text += (
+            f"медиана {format_duration(sketch.quantile(0.5))}, "
+            f"p90 {format_duration(sketch.quantile(0.9))}, "
+            f"p99 {format_duration(sketch.quantile(0.99))}\n"
+        )
+
+    text += "\n<b>👥 По сотрудникам</b>\n"
+    helpers = stats.top_helpers()
+    if not helpers:
+        text += "<i>нет данных</i>\n"
+    for name, count, average in helpers:
+        text += f"@{name}: {count} шт., в среднем {format_duration(average)}\n"
+
+    text += f"\n<b>📥 Очередь по часам</b> (сейчас открыто: {open_now})\n"
+    for hour, created, answered, open_at_end in stats.backlog(open_now, backlog_hours):
+        label = datetime.fromtimestamp(hour * 3600).strftime("%H:00")
+        text += f"<code>{label}</code> +{created} / −{answered} → {open_at_end}\n"
+    return text
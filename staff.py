@@ -0,0 +1,125 @@
+import logging
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class StaffRoster:
+    """Список персонала в памяти процесса с индексом по Telegram user_id.
+
+    Загружается из таблицы helpers один раз при старте и обновляется
+    write-through из хендлеров добавления/удаления помощников, поэтому
+    проверка прав и рассылка персоналу не ходят в базу.
+
+    Запись helpers (и админ из ADMINS) привязывается к числовому user_id
+    при первом контакте по username или заранее из реестра chat_ids.
+    После привязки права проверяются только по id: переименование
+    сотрудника их не ломает, а занявший его старый username — не получает.
+    Новые привязки копятся в памяти и сохраняются батчем из flush().
+    """
+
+    def __init__(self, admins: Iterable[str]):
+        self.admins: Set[str] = {a.lower() for a in admins if a}
+        self._helpers: Set[str] = set()
+        # user_id -> имя записи в helpers и обратно
+        self._by_id: Dict[int, str] = {}
+        self._ids: Dict[str, int] = {}
+        self._unsaved: Dict[str, int] = {}
+        # Проверки прав is_staff / is_admin: сотрудник найден / не найден
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self, db: Database):
+        rows = await db.fetchall("SELECT username, user_id FROM helpers")
+        self._helpers = {row[0].lower() for row in rows}
+        self._by_id = {user_id: uname.lower() for uname, user_id in rows if user_id is not None}
+        self._ids = {uname: user_id for user_id, uname in self._by_id.items()}
+        logger.info(
+            f"Staff roster loaded: {len(self._helpers)} helpers, {len(self._by_id)} bound to user_id"
+        )
+
+    def resolve(self, user_id: int, username: Optional[str] = None) -> Optional[str]:
+        """Имя записи персонала для пользователя Telegram или None"""
+        name = self._by_id.get(user_id)
+        if name is None and username:
+            uname = username.lower()
+            if uname not in self._ids and (uname in self.admins or uname in self._helpers):
+                name = self._bind(uname, user_id)
+        return name
+
+    def _bind(self, name: str, user_id: int) -> str:
+        self._by_id[user_id] = name
+        self._ids[name] = user_id
+        self._unsaved[name] = user_id
+        logger.info(f"Staff @{name} bound to user_id {user_id}")
+        return name
+
+    def _check(self, user_id: int, username: Optional[str]) -> Optional[str]:
+        # Счётчики — только для проверок прав, а не для служебных вызовов resolve
+        name = self.resolve(user_id, username)
+        if name is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return name
+
+    def is_staff(self, user_id: int, username: Optional[str] = None) -> bool:
+        return self._check(user_id, username) is not None
+
+    def is_admin(self, user_id: int, username: Optional[str] = None) -> bool:
+        return self._check(user_id, username) in self.admins
+
+    def backfill(self, lookup: Callable[[str], Optional[int]]):
+        """Привязывает ещё не привязанных по известным user_id (реестр chat_ids)"""
+        for name in self.all_staff():
+            if name in self._ids:
+                continue
+            user_id = lookup(name)
+            if user_id is not None and user_id not in self._by_id:
+                self._bind(name, user_id)
+
+    def add(self, username: str, user_id: Optional[int] = None):
+        name = username.lower()
+        self._helpers.add(name)
+        if user_id is not None and user_id not in self._by_id:
+            self._bind(name, user_id)
+
+    def remove(self, username: str):
+        name = username.lower()
+        self._helpers.discard(name)
+        self._unsaved.pop(name, None)
+        user_id = self._ids.pop(name, None)
+        if user_id is not None:
+            del self._by_id[user_id]
+
+    def all_staff(self) -> Set[str]:
+        return self.admins | self._helpers
+
+    def chat_ids(self) -> Dict[str, int]:
+        """Имя -> id личного чата для привязанных сотрудников (в личке chat_id == user_id)"""
+        staff = self.all_staff()
+        return {name: user_id for name, user_id in self._ids.items() if name in staff}
+
+    async def flush(self, db: Database):
+        if not self._unsaved:
+            return
+        batch, self._unsaved = self._unsaved, {}
+        try:
+            await db.executemany(
+                "UPDATE helpers SET user_id = ? WHERE username = ?",
+                [(user_id, name) for name, user_id in batch.items()]
+            )
+        except Exception as e:
+            for name, user_id in batch.items():
+                self._unsaved.setdefault(name, user_id)
+            logger.error(f"Staff roster flush failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "helpers": len(self._helpers),
+            "bound": len(self._by_id),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,91 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+from cache import LRUCache
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# (токенов в секунду, ёмкость)
+Rate = Tuple[float, float]
+
+DEFAULT_USER_RATE: Rate = (2.0, 10)
+NOTICE_RATE: Rate = (0.1, 1)
+MAX_BUCKETS = 50000
+
+THROTTLED_TEXT = "⏳ Слишком часто! Подождите немного и попробуйте снова."
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Анти-флуд на token bucket'ах: общий лимит на пользователя и лимиты действий.
+
+    Действие — префикс callback_data или FSM-состояние для сообщений
+    (например, отправка текста обращения). Бакеты лежат в LRU ограниченного
+    размера; полностью восстановившиеся бакеты эквивалентны отсутствующим,
+    поэтому вытеснение их ничего не теряет. Заблокированные апдейты
+    отвечаются без обращения к базе.
+    """
+
+    def __init__(
+        self,
+        actions: Optional[Dict[str, Rate]] = None,
+        user_rate: Rate = DEFAULT_USER_RATE,
+        exempt: Optional[Callable[[User], bool]] = None,
+        max_buckets: int = MAX_BUCKETS,
+    ):
+        self.actions = actions or {}
+        self.user_rate = user_rate
+        self.exempt = exempt
+        self._buckets = LRUCache(max_buckets)
+        self.throttled = 0
+
+    def _bucket(self, key: Hashable, rate: Rate) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*rate)
+            self._buckets.set(key, bucket)
+        return bucket
+
+    def _action(self, event: TelegramObject, data: Dict[str, Any]) -> Optional[str]:
+        if isinstance(event, CallbackQuery):
+            key = event.data or ""
+        else:
+            key = data.get("raw_state") or ""
+        for action in self.actions:
+            if key.startswith(action):
+                return action
+        return None
+
+    def allow(self, user_id: int, action: Optional[str]) -> bool:
+        if not self._bucket(user_id, self.user_rate).try_acquire():
+            return False
+        if action is not None:
+            return self._bucket((user_id, action), self.actions[action]).try_acquire()
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is None or (self.exempt and self.exempt(user)):
+            return await handler(event, data)
+
+        if self.allow(user.id, self._action(event, data)):
+            return await handler(event, data)
+
+        self.throttled += 1
+        if isinstance(event, CallbackQuery):
+            await event.answer(THROTTLED_TEXT)
+        elif isinstance(event, Message):
+            # На сообщения отвечаем не чаще раза в NOTICE_RATE, чтобы флуд не усиливался
+            if self._bucket((user.id, "notice"), NOTICE_RATE).try_acquire():
+                await event.answer(THROTTLED_TEXT)
+
+    def stats(self) -> Dict[str, int]:
+        return {"buckets": len(self._buckets), "throttled": self.throttled}
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 16
+QUEUE_SIZE = 1000
+DRAIN_TIMEOUT = 10.0
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+Job = Tuple[Handler, TelegramObject, Dict[str, Any]]
+
+
+class UpdateWorkerPool(BaseMiddleware):
+    """Ограниченный пул обработчиков апдейтов с упорядочиванием по пользователю.
+
+    Регистрируется как outer-middleware на dp.update: вызов лишь ставит
+    апдейт в очередь и возвращается, а обработку выполняют workers
+    воркеров. Апдейты одного from_user.id обрабатываются строго по одному
+    и по порядку (FSM-переходы не гоняются), разные пользователи — параллельно.
+    Всего в очереди не больше queue_size апдейтов; при переполнении
+    постановка ждёт, и давление передаётся на polling / webhook.
+    """
+
+    def __init__(self, workers: int = WORKERS, queue_size: int = QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = asyncio.Semaphore(queue_size)
+        self._pending: Dict[Hashable, Deque[Job]] = {}
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self.depth = 0
+        self.processed = 0
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not self._tasks:
+            # Пул не запущен (например, в тестах) — обрабатываем напрямую
+            return await handler(event, data)
+        await self.submit(self._key(event, data), handler, event, data)
+
+    @staticmethod
+    def _key(event: TelegramObject, data: Dict[str, Any]) -> Hashable:
+        user = data.get("event_from_user")
+        if user is not None:
+            return user.id
+        # Апдейты без пользователя не связаны между собой
+        return ("update", getattr(event, "update_id", id(event)))
+
+    async def submit(self, key: Hashable, handler: Handler, event: TelegramObject, data: Dict[str, Any]):
+        await self._slots.acquire()
+        self.depth += 1
+        queue = self._pending.get(key)
+        if queue is not None:
+            # Пользователь уже в работе или ждёт воркера: просто в конец его очереди
+            queue.append((handler, event, data))
+        else:
+            self._pending[key] = deque([(handler, event, data)])
+            self._ready.put_nowait(key)
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            while queue:
+                handler, event, data = queue.popleft()
+                try:
+                    await handler(event, data)
+                except Exception:
+                    logger.exception(f"Update handling failed for {key}")
+                finally:
+                    self.depth -= 1
+                    self.processed += 1
+                    self._slots.release()
+            del self._pending[key]
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"Update worker pool started: {self.workers} workers, queue {self.queue_size}")
+
+    async def stop(self, timeout: Optional[float] = DRAIN_TIMEOUT):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._drained(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Update worker pool stopped with {self.depth} updates pending")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _drained(self):
+        while self.depth:
+            await asyncio.sleep(0.05)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "depth": self.depth,
+            "active_users": len(self._pending),
+            "processed": self.processed,
+        }